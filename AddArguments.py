@@ -1,6 +1,5 @@
 import argparse
 import re
-from astropy.time import Time
 
 
 def get_parser():
@@ -27,6 +26,16 @@ def get_parser():
         help="Include observations of sources within 5 deg of <ObjectName> in the analysis. default= False",
         action="store_true",
     )
+    parser.add_argument(
+        "-ExplainSelection",
+        help="Write to the log how many runs each run selection (run list, object name, dates, ...) removed. default= False",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-LogHDUTable",
+        help="Write the full HDU index table to the log (by default only its length is written). default= False",
+        action="store_true",
+    )
     parser.add_argument(
         "-DL3Path",
         help="Path to the DL3 data folder. default= './DL3'",
@@ -81,6 +90,32 @@ def get_parser():
         required=False,
         default="ReflectedRegions",
     )
+    parser.add_argument(
+        "-NJobs",
+        help="Number of local processes used to reduce the runs in parallel. default= 1 (serial)",
+        type=int,
+        required=False,
+        default=1,
+    )
+    parser.add_argument(
+        "-CacheDir",
+        help="Directory for cached products (e.g. reduced per-run datasets). Can be shared between analyses. default= '<ADir>/Cache'",
+        type=str,
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-NoCache",
+        help="Do not read or write any cached products (resolved target positions are still cached). default= False",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-TargetPositionsCSV",
+        help="Path to a CSV file of target positions used instead of resolving <ObjectName> online. The CSV should have columns: name, ra (deg), dec (deg). No header is required. Names resolved online are cached in <CacheDir>/TargetPositions.ecsv",
+        type=str,
+        required=False,
+        default=None,
+    )
     parser.add_argument(
         "-NameSourceInOnOffRegionPlot",
         help="Do you want the ObjectName to be printed on the On, Off, Exclusion regions plot?",
@@ -336,6 +371,13 @@ def get_parser():
     )
 
     # Exclusion Regions
+    parser.add_argument(
+        "-BrightStarCatalog",
+        help="Path to a local bright star catalog made with BrightStars.py. If given, the bright star exclusion regions are found offline instead of querying Vizier. default= None",
+        type=str,
+        required=False,
+        default=None,
+    )
     parser.add_argument(
         "-exclusion_csv",
         help="Path to a CSV file containing user-defined exclusion regions."
@@ -378,6 +420,8 @@ def CheckAllowedSpectralModelInputted(args):
 
 
 def parse_time(value):
+    from astropy.time import Time
+
     try:
         if ":" in value:
             fmt, timestr = value.split(":", 1)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+from importer import *
+
+BRIGHT_STAR_COLUMNS = ["RA(ICRS)", "DE(ICRS)", "BTmag", "TYC1", "TYC2", "TYC3", "HIP"]
+
+# Catalogs already read in this process, keyed by path
+_catalogs = {}
+
+
+def MakeBrightStarCatalog(output_path, mag_limit=6):
+    """
+    One-off extraction (needs network) of the Tycho2 stars with BTmag < mag_limit.
+    The catalog is written sorted by declination so that ConeSearchBrightStars
+    only has to look at one declination band.
+    Example usage:
+        python BrightStars.py -Output BrightStars.fits -MagLimit 6
+    """
+    vizier = Vizier(
+        catalog="I/259/tyc2",
+        columns=BRIGHT_STAR_COLUMNS,
+        column_filters={"BTmag": f"<{mag_limit}"},
+        row_limit=-1,
+    )
+    stars = vizier.query_constraints()[0][BRIGHT_STAR_COLUMNS]
+    stars.sort("DE(ICRS)")
+    stars.meta["MAGLIMIT"] = mag_limit
+    stars.write(output_path, format="fits", overwrite=True)
+    return stars
+
+
+def ReadBrightStarCatalog(path):
+    if path not in _catalogs:
+        stars = Table.read(path, format="fits")
+        if np.any(np.diff(stars["DE(ICRS)"]) < 0):
+            stars.sort("DE(ICRS)")
+        _catalogs[path] = stars
+    return _catalogs[path]
+
+
+def ConeSearchBrightStars(stars, target_position, radius, mag_limit):
+    """
+    Stars (a declination sorted catalog) within radius of target_position with BTmag < mag_limit.
+    Raises ValueError if the catalog was made with a lower MAGLIMIT, as it is
+    then missing stars down to mag_limit.
+    """
+    catalog_limit = stars.meta.get("MAGLIMIT")
+    if catalog_limit is not None and catalog_limit < mag_limit:
+        raise ValueError(
+            f"The bright star catalog only has stars with BTmag < {catalog_limit}, "
+            f"but stars down to BTmag < {mag_limit} are needed. Remake it with "
+            f"python BrightStars.py -MagLimit {mag_limit}"
+        )
+    dec = target_position.dec.deg
+    radius_deg = radius.to_value("deg")
+    # Only the declination band [dec - radius, dec + radius] can be in the cone
+    start, stop = np.searchsorted(
+        np.asarray(stars["DE(ICRS)"]), [dec - radius_deg, dec + radius_deg]
+    )
+    band = stars[start:stop]
+    separation = angular_separation(
+        target_position.ra,
+        target_position.dec,
+        np.asarray(band["RA(ICRS)"]) * u.deg,
+        np.asarray(band["DE(ICRS)"]) * u.deg,
+    )
+    selected = (separation <= radius) & (np.asarray(band["BTmag"]) < mag_limit)
+    return band[selected]
+
+
+def QueryBrightStars(target_position, radius, mag_limit):
+    """
+    Same as ConeSearchBrightStars but queries the Tycho2 catalog on Vizier.
+    """
+    vizier = Vizier(catalog="Tycho2")
+    vizier.ROW_LIMIT = 100000
+    vizier.COL_LIMIT = -1
+    result = vizier.query_region(target_position, radius=radius)
+    stars = result[0][BRIGHT_STAR_COLUMNS]
+    btmag = stars["BTmag"]
+    if hasattr(btmag, "filled"):
+        btmag = btmag.filled(np.inf)
+    return stars[np.asarray(btmag) < mag_limit]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Extract the bright Tycho2 stars used for the exclusion regions into a local catalog."
+    )
+    parser.add_argument("-Output", help="Output FITS file.", default="BrightStars.fits")
+    parser.add_argument(
+        "-MagLimit", help="Keep stars with BTmag below this.", type=float, default=6
+    )
+    args = parser.parse_args()
+
+    stars = MakeBrightStarCatalog(args.Output, mag_limit=args.MagLimit)
+    print(f"Wrote {len(stars)} stars with BTmag < {args.MagLimit} to {args.Output}.")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+from importer import *
+from RunLogger import GetRunLogger
+from concurrent.futures import ThreadPoolExecutor
+from Cache import ReadJSON, WriteJSON
+from DL3Files import FindDL3Files
+
+HDU_INDEX_FILE = "hdu-index.fits.gz"
+OBS_INDEX_FILE = "obs-index.fits.gz"
+# Per-file header summaries from the last BuildIndex call, so unchanged files are not re-read
+INDEX_STATE_FILE = ".index-state.json"
+
+# (HDUCLAS1, HDUCLAS2) -> HDU_TYPE and HDUCLAS4 -> HDU_CLASS, as in the GADF index spec
+HDU_TYPES = {
+    ("EVENTS", None): "events",
+    ("GTI", None): "gti",
+    ("RESPONSE", "EFF_AREA"): "aeff",
+    ("RESPONSE", "EDISP"): "edisp",
+    ("RESPONSE", "RPSF"): "psf",
+    ("RESPONSE", "BKG"): "bkg",
+    ("RESPONSE", "RAD_MAX"): "rad_max",
+}
+
+# EVENTS header keywords copied into the obs index (if present), with units
+OBS_INDEX_KEYWORDS = {
+    "OBS_ID": None,
+    "TSTART": "s",
+    "TSTOP": "s",
+    "ONTIME": "s",
+    "LIVETIME": "s",
+    "DEADC": None,
+    "RA_PNT": "deg",
+    "DEC_PNT": "deg",
+    "ALT_PNT": "deg",
+    "AZ_PNT": "deg",
+    "ZEN_PNT": "deg",
+    "RA_OBJ": "deg",
+    "DEC_OBJ": "deg",
+    "OBJECT": None,
+    "DATE-OBS": None,
+    "TIME-OBS": None,
+    "DATE-END": None,
+    "TIME-END": None,
+    "N_TELS": None,
+    "TELLIST": None,
+    "TELESCOP": None,
+    "INSTRUME": None,
+    "QUALITY": None,
+}
+# Copied from the first EVENTS header into the obs index header
+TIME_KEYWORDS = ["MJDREFI", "MJDREFF", "TIMEUNIT", "TIMESYS", "TIMEREF"]
+
+
+def BuildIndex(dl3_path, n_jobs=8, path_to_log=None):
+    """
+    Write hdu-index.fits.gz and obs-index.fits.gz for a directory of DL3 files.
+    Only the FITS headers are read (no event data), n_jobs files at a time.
+    Files that are unchanged (size and mtime) since the last call are not read
+    again, so re-indexing a directory after a new delivery only scans the new files.
+    Returns the number of files that were (re-)scanned.
+
+    Example usage:
+        python BuildIndex.py /path/to/DL3 -NJobs 16
+    """
+    state_path = os.path.join(dl3_path, INDEX_STATE_FILE)
+    state = ReadJSON(state_path, default={})
+    files = FindDL3Files(dl3_path)
+    stamps = {}
+    for path in files:
+        stat = os.stat(os.path.join(dl3_path, path))
+        stamps[path] = [stat.st_size, stat.st_mtime_ns]
+    to_scan = [
+        path
+        for path in files
+        if path not in state or state[path]["stamp"] != stamps[path]
+    ]
+    with ThreadPoolExecutor(max_workers=max(n_jobs, 1)) as pool:
+        scanned = list(pool.map(lambda path: ReadFileHeaders(dl3_path, path), to_scan))
+    state = {path: state[path] for path in files if path not in to_scan}
+    for path, summary in zip(to_scan, scanned):
+        state[path] = dict(summary, stamp=stamps[path])
+
+    hdu_rows = []
+    obs_rows = []
+    time_meta = {}
+    for path in files:
+        summary = state[path]
+        if summary["obs_id"] is None:
+            continue
+        for hdu in summary["hdus"]:
+            hdu_rows.append(
+                (
+                    summary["obs_id"],
+                    hdu["type"],
+                    hdu["class"],
+                    os.path.dirname(path) or ".",
+                    os.path.basename(path),
+                    hdu["name"],
+                )
+            )
+        if summary["obs"] is not None:
+            obs_rows.append(dict(summary["obs"], EVENTS_FILENAME=path))
+            if not time_meta:
+                time_meta = summary["time_meta"]
+
+    hdu_table = Table(
+        rows=hdu_rows,
+        names=("OBS_ID", "HDU_TYPE", "HDU_CLASS", "FILE_DIR", "FILE_NAME", "HDU_NAME"),
+        dtype=(np.int64, str, str, str, str, str),
+    )
+    hdu_table.meta.update(HDUCLASS="GADF", HDUCLAS1="INDEX", HDUCLAS2="HDU")
+    obs_table = MakeObsTable(obs_rows)
+    obs_table.meta.update(time_meta)
+    obs_table.meta.update(HDUCLASS="GADF", HDUCLAS1="INDEX", HDUCLAS2="OBS")
+
+    WriteTable(hdu_table, os.path.join(dl3_path, HDU_INDEX_FILE))
+    WriteTable(obs_table, os.path.join(dl3_path, OBS_INDEX_FILE))
+    WriteJSON(state_path, state)
+    if path_to_log is not None:
+        with GetRunLogger(path_to_log) as f:
+            f.write(
+                f"Built {HDU_INDEX_FILE} and {OBS_INDEX_FILE} for {dl3_path}: {len(obs_table)} runs, {len(hdu_table)} HDUs ({len(to_scan)} of {len(files)} files scanned)\n"
+            )
+    return len(to_scan)
+
+
+def ReadFileHeaders(dl3_path, path):
+    """
+    Summary of one DL3 file from its headers: OBS_ID, the HDUs it contains and,
+    if it has an EVENTS HDU, the obs index row.
+    """
+    summary = {"obs_id": None, "hdus": [], "obs": None, "time_meta": {}}
+    with fits.open(os.path.join(dl3_path, path), lazy_load_hdus=True) as hdulist:
+        for hdu in hdulist:
+            header = hdu.header
+            if summary["obs_id"] is None and "OBS_ID" in header:
+                summary["obs_id"] = int(header["OBS_ID"])
+            hdu_class_1 = str(header.get("HDUCLAS1", "")).strip().upper()
+            hdu_class_2 = header.get("HDUCLAS2") if hdu_class_1 == "RESPONSE" else None
+            hdu_type = HDU_TYPES.get(
+                (hdu_class_1, str(hdu_class_2).strip().upper() if hdu_class_2 else None)
+            )
+            if hdu_type is None:
+                continue
+            hdu_class = hdu_type
+            if hdu_class_1 == "RESPONSE":
+                hdu_class = str(header.get("HDUCLAS4", hdu_type)).strip().lower()
+            summary["hdus"].append(
+                {"type": hdu_type, "class": hdu_class, "name": hdu.name}
+            )
+            if hdu_type == "events":
+                summary["obs"] = {
+                    key: header[key] for key in OBS_INDEX_KEYWORDS if key in header
+                }
+                summary["obs"]["EVENT_COUNT"] = header.get("NAXIS2", 0)
+                summary["time_meta"] = {
+                    key: header[key] for key in TIME_KEYWORDS if key in header
+                }
+    if summary["obs"] is not None:
+        summary["obs"]["OBS_ID"] = summary["obs_id"]
+    return summary
+
+
+def MakeObsTable(obs_rows):
+    columns = {}
+    keys = list(OBS_INDEX_KEYWORDS) + ["EVENT_COUNT", "EVENTS_FILENAME"]
+    for key in keys:
+        values = [row.get(key) for row in obs_rows]
+        present = [value for value in values if value is not None]
+        if key != "OBS_ID" and not present:
+            continue
+        if all(isinstance(value, str) for value in present):
+            columns[key] = np.array(
+                ["" if value is None else value for value in values], dtype=str
+            )
+        elif all(
+            isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+            for value in present
+        ):
+            columns[key] = np.array(
+                [-1 if value is None else value for value in values], dtype=np.int64
+            )
+        else:
+            columns[key] = np.array(
+                [np.nan if value is None else value for value in values], dtype=float
+            )
+    obs_table = Table(columns)
+    for key, unit in OBS_INDEX_KEYWORDS.items():
+        if unit is not None and key in obs_table.colnames:
+            obs_table[key].unit = unit
+    obs_table.sort("OBS_ID")
+    return obs_table
+
+
+def WriteTable(table, path):
+    # Write then rename so that a reader never sees a partly written file.
+    # The temporary name keeps the extension so that astropy still compresses it.
+    directory, filename = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{os.getpid()}.tmp.{filename}")
+    table.write(tmp_path, format="fits", overwrite=True)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write the HDU and obs index files for a directory of DL3 files."
+    )
+    parser.add_argument("DL3Path", help="Directory of DL3 FITS files.")
+    parser.add_argument(
+        "-NJobs", help="Number of files read at a time.", type=int, default=8
+    )
+    args = parser.parse_args()
+
+    n_scanned = BuildIndex(args.DL3Path, n_jobs=args.NJobs)
+    print(
+        f"Wrote {HDU_INDEX_FILE} and {OBS_INDEX_FILE} in {args.DL3Path} ({n_scanned} files scanned)."
+    )
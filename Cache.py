@@ -0,0 +1,87 @@
+from importer import *
+import hashlib
+import json
+
+
+def GetCacheDir(args, *subdirs, ignore_no_cache=False):
+    """
+    Returns the cache directory <CacheDir>/<subdirs> (created if needed).
+    CacheDir defaults to <ADir>/Cache; point several analyses at the same
+    -CacheDir to share products between them.
+    Returns None if caching is switched off with -NoCache, unless ignore_no_cache
+    (for lookups such as resolved target names that are not analysis products).
+    """
+    if args.NoCache and not ignore_no_cache:
+        return None
+    cache_dir = args.CacheDir
+    if cache_dir is None:
+        cache_dir = os.path.join(args.ADir, "Cache")
+    cache_dir = os.path.join(cache_dir, *subdirs)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def HashItems(*items):
+    """
+    sha256 hex digest of the items.
+    numpy arrays (and Quantities) are hashed by dtype, shape and raw bytes,
+    everything else by repr.
+    """
+    sha = hashlib.sha256()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            array = np.ascontiguousarray(item)
+            sha.update(str((array.dtype.str, array.shape)).encode())
+            sha.update(array.tobytes())
+        else:
+            sha.update(repr(item).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def HashFiles(paths, cache_dir=None, chunk_size=2**24):
+    """
+    sha256 hex digests of the contents of a list of files.
+    If cache_dir is given, digests are remembered in <cache_dir>/FileHashes.json
+    against each file's size and mtime so unchanged files are only read once.
+    """
+    known = {}
+    if cache_dir is not None:
+        known = ReadJSON(os.path.join(cache_dir, "FileHashes.json"), default={})
+    digests = []
+    new = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        if path in known and known[path]["stamp"] == stamp:
+            digests.append(known[path]["sha256"])
+            continue
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha.update(chunk)
+        digests.append(sha.hexdigest())
+        new[path] = {"stamp": stamp, "sha256": digests[-1]}
+    if cache_dir is not None and new:
+        # Re-read so that entries written by other processes are kept
+        known = ReadJSON(os.path.join(cache_dir, "FileHashes.json"), default={})
+        known.update(new)
+        WriteJSON(os.path.join(cache_dir, "FileHashes.json"), known)
+    return digests
+
+
+def ReadJSON(path, default=None):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def WriteJSON(path, content):
+    # Write then rename so that a reader never sees a partly written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(content, f, indent=1)
+    os.replace(tmp_path, path)
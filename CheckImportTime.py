@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import subprocess
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Import time budget [s] of `<script> -h` for the command line entry points
+IMPORT_TIME_BUDGETS = {
+    "DL3toDL5.py": 0.5,
+    "NumberOfEventsInFitsFile.py": 1.0,
+    "BuildIndex.py": 0.5,
+    "CompareFitsFilesFolders.py": 1.0,
+    "CompareVEGASGammapy.py": 1.5,
+    "VEGASStage6Log.py": 0.5,
+    "BrightStars.py": 0.5,
+}
+
+
+def MeasureImportTime(script, repeats=3):
+    """
+    Total import time [s] of `python -X importtime <script> -h`
+    (sum of the cumulative times of the top level imports), best of repeats.
+    Also returns the five slowest top level imports of the best run.
+    Raises RuntimeError (with stderr) if the script fails.
+    """
+    best = None
+    for _ in range(repeats):
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                os.path.join(script_dir, script),
+                "-h",
+            ],
+            capture_output=True,
+            text=True,
+            cwd=script_dir,
+        )
+        # A script that fails to import would otherwise look very fast
+        if result.returncode != 0:
+            error = "\n".join(
+                line
+                for line in result.stderr.splitlines()
+                if not line.startswith("import time:")
+            )
+            raise RuntimeError(f"{script} -h exited with {result.returncode}:\n{error}")
+        top_level = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            # Nested imports are indented by two more spaces per level
+            if name.startswith("  "):
+                continue
+            top_level.append((int(cumulative) / 1e6, name.strip()))
+        total = sum(seconds for seconds, _ in top_level)
+        if best is None or total < best[0]:
+            best = (total, sorted(top_level, reverse=True)[:5])
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the import time of the command line entry points against their budgets."
+    )
+    parser.add_argument(
+        "Scripts",
+        nargs="*",
+        help="Entry points to check, default= all in IMPORT_TIME_BUDGETS",
+    )
+    parser.add_argument(
+        "-Repeats", help="Best of this many runs, default= 3", type=int, default=3
+    )
+    args = parser.parse_args()
+
+    over_budget = []
+    for script in args.Scripts or IMPORT_TIME_BUDGETS:
+        try:
+            total, slowest = MeasureImportTime(script, repeats=args.Repeats)
+        except RuntimeError as e:
+            print(f"{script}: FAILED\n{e}")
+            over_budget.append(script)
+            continue
+        budget = IMPORT_TIME_BUDGETS.get(script)
+        status = "" if budget is None else f"(budget {budget:.2f} s)"
+        if budget is not None and total > budget:
+            status += " OVER BUDGET"
+            over_budget.append(script)
+        print(f"{script}: {total:.2f} s {status}")
+        for seconds, name in slowest:
+            print(f"    {seconds:.2f} s {name}")
+    sys.exit(1 if over_budget else 0)
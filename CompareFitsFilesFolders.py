@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 import os
+import gzip
+import hashlib
+import json
 import argparse
 import numpy as np
 from astropy.io import fits
+from astropy.table import Table
+from Parallel import ParallelMap
+
+# Left out of the header comparison: they change whenever anything in the HDU does
+CHECKSUM_KEYWORDS = ("CHECKSUM", "DATASUM")
+# Bytes read / compared at a time, so that no HDU is ever held in memory in full
+CHUNK_BYTES = 64 * 1024**2
 
 
 def compare_fits_files(file1, file2, filelength):
@@ -86,6 +96,367 @@ def compare_fits_folders(folder1, folder2, filelength):
     return True
 
 
+def list_fits_files(folder):
+    return sorted(f for f in os.listdir(folder) if f.endswith((".fits", ".fits.gz")))
+
+
+def read_hdu_summaries(path):
+    """
+    Header, DATASUM and the location of the data of every HDU in a FITS file.
+    Only the headers are read. The header is a dict keyword: value, with a list
+    of the values for keywords that appear more than once.
+    """
+    summaries = []
+    with fits.open(path, lazy_load_hdus=True) as hdul:
+        for i, hdu in enumerate(hdul):
+            header = hdu.header
+            # Repeated keywords (HISTORY, COMMENT, ...) keep all their values, as a list
+            values = {}
+            for card in header.cards:
+                if card.keyword not in CHECKSUM_KEYWORDS:
+                    values.setdefault(card.keyword, []).append(card.value)
+            summaries.append(
+                {
+                    "name": hdu.name,
+                    "header": {
+                        keyword: value[0] if len(value) == 1 else value
+                        for keyword, value in values.items()
+                    },
+                    "datasum": header.get("DATASUM"),
+                    "data_offset": hdul.fileinfo(i)["datLoc"],
+                    "data_size": hdu.size,
+                }
+            )
+    return summaries
+
+
+def hash_hdu_data(path, data_offset, data_size):
+    """
+    sha256 of the raw data bytes of one HDU, read CHUNK_BYTES at a time.
+    """
+    sha = hashlib.sha256()
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        f.seek(data_offset)
+        remaining = data_size
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            sha.update(chunk)
+            remaining -= len(chunk)
+    return sha.hexdigest()
+
+
+def make_difference(file, kind, hdu=None, name=None, item="", **fields):
+    """
+    One record of the difference report. kind is one of missing, hdu_count,
+    header (item = keyword) or data (item = table column, or DATA for images).
+    """
+    difference = {
+        "file": file,
+        "hdu": hdu,
+        "name": name,
+        "kind": kind,
+        "item": item,
+        "value1": None,
+        "value2": None,
+        "n_different": None,
+        "n_rows": None,
+        "max_abs_diff": None,
+        "max_rel_diff": None,
+        "detail": "",
+    }
+    difference.update(fields)
+    return difference
+
+
+def compare_values(values1, values2, rtol=0.0, atol=0.0):
+    """
+    Row by row comparison of two equally shaped arrays.
+    Returns (row differs, |values1 - values2|, relative difference w.r.t. values2);
+    the differences are None for non-numeric values. Float and complex values
+    are equal within rtol/atol (and NaN equals NaN), everything else has to be
+    equal exactly.
+    """
+    n_rows = len(values1)
+    if values1.dtype.kind == "O":  # Variable length array columns
+        differs = np.array(
+            [not np.array_equal(a, b) for a, b in zip(values1, values2)], dtype=bool
+        )
+        return differs, None, None
+    if values1.dtype.kind not in "biufc" or values2.dtype.kind not in "biufc":
+        differs = (values1 != values2).reshape(n_rows, -1).any(axis=1)
+        return differs, None, None
+    values1 = values1.reshape(n_rows, -1)
+    values2 = values2.reshape(n_rows, -1)
+    kinds = {values1.dtype.kind, values2.dtype.kind}
+    if "c" in kinds:
+        values1 = values1.astype(np.complex128)
+        values2 = values2.astype(np.complex128)
+        equal = np.isclose(values1, values2, rtol=rtol, atol=atol, equal_nan=True)
+    elif "f" in kinds:
+        values1 = values1.astype(np.float64)
+        values2 = values2.astype(np.float64)
+        equal = np.isclose(values1, values2, rtol=rtol, atol=atol, equal_nan=True)
+    else:
+        # Integers and bools are compared exactly, on their own dtype
+        # (as float64, integers above 2**53 could compare equal)
+        equal = values1 == values2
+        values1 = values1.astype(np.float64)
+        values2 = values2.astype(np.float64)
+    abs_diff = np.abs(values1 - values2)
+    scale = np.abs(values2)
+    rel_diff = np.divide(
+        abs_diff,
+        scale,
+        out=np.where(abs_diff > 0, np.inf, 0.0),
+        where=scale > 0,
+    )
+    return ~equal.all(axis=1), abs_diff, rel_diff
+
+
+def compare_hdu_data(file1, file2, index, rtol=0.0, atol=0.0):
+    """
+    Compares the data of HDU `index` of two files CHUNK_BYTES at a time from
+    memory mapped arrays, column by column for tables.
+    Returns a list of (item, number of differing rows, number of rows,
+    max abs difference, max relative difference) for the items that differ,
+    or None if the shapes, types or columns differ.
+    """
+    with fits.open(file1, memmap=True) as hdul1, fits.open(file2, memmap=True) as hdul2:
+        data1 = hdul1[index].data
+        data2 = hdul2[index].data
+        if data1 is None or data2 is None:
+            return None
+        if isinstance(data1, fits.FITS_rec) != isinstance(data2, fits.FITS_rec):
+            return None
+        if isinstance(data1, fits.FITS_rec):
+            if data1.names != data2.names or len(data1) != len(data2):
+                return None
+            items = data1.names
+        else:
+            if data1.shape != data2.shape:
+                return None
+            data1 = np.atleast_1d(data1)
+            data2 = np.atleast_1d(data2)
+            items = ["DATA"]
+        n_rows = len(data1)
+        row_bytes = max(data1.nbytes // max(n_rows, 1), 1)
+        chunk_rows = max(CHUNK_BYTES // row_bytes, 1)
+        stats = {item: [0, np.nan, np.nan] for item in items}
+        for start in range(0, n_rows, chunk_rows):
+            chunk1 = data1[start : start + chunk_rows]
+            chunk2 = data2[start : start + chunk_rows]
+            for item in items:
+                if item == "DATA":
+                    values1, values2 = np.asarray(chunk1), np.asarray(chunk2)
+                else:
+                    values1 = np.asarray(chunk1.field(item))
+                    values2 = np.asarray(chunk2.field(item))
+                differs, abs_diff, rel_diff = compare_values(
+                    values1, values2, rtol=rtol, atol=atol
+                )
+                stats[item][0] += int(np.count_nonzero(differs))
+                if abs_diff is not None and abs_diff.size:
+                    stats[item][1] = np.fmax(
+                        stats[item][1], np.nanmax(abs_diff, initial=0)
+                    )
+                    stats[item][2] = np.fmax(
+                        stats[item][2], np.nanmax(rel_diff, initial=0)
+                    )
+    return [
+        (item, n_different, n_rows, max_abs_diff, max_rel_diff)
+        for item, (n_different, max_abs_diff, max_rel_diff) in stats.items()
+        if n_different > 0
+    ]
+
+
+def compare_fits_files_all_hdus(file1, file2, rtol=0.0, atol=0.0):
+    """
+    Compares every HDU of two FITS files and returns a list of all the
+    differences found (empty if the files are identical), as make_difference
+    records: one per differing header keyword (with both values) and one per
+    differing table column (with the number of differing rows and the max
+    abs/rel difference).
+    Float values are equal within rtol/atol.
+
+    The data of an HDU is taken to be identical only if the streamed sha256
+    hashes of the raw data match. Different DATASUMs skip the hashing, as
+    the data then differs anyway. Only otherwise is the data compared (in
+    chunks, memory mapped).
+    """
+    filename = os.path.basename(file1)
+    summaries1 = read_hdu_summaries(file1)
+    summaries2 = read_hdu_summaries(file2)
+    differences = []
+    if len(summaries1) != len(summaries2):
+        differences.append(
+            make_difference(
+                filename,
+                "hdu_count",
+                value1=len(summaries1),
+                value2=len(summaries2),
+                detail=f"{len(summaries1)} HDUs vs {len(summaries2)} HDUs",
+            )
+        )
+    for index, (hdu1, hdu2) in enumerate(zip(summaries1, summaries2)):
+        location = {"hdu": index, "name": hdu1["name"]}
+        header1, header2 = hdu1["header"], hdu2["header"]
+        for keyword in dict.fromkeys(list(header1) + list(header2)):
+            if header1.get(keyword) != header2.get(keyword):
+                differences.append(
+                    make_difference(
+                        filename,
+                        "header",
+                        item=keyword,
+                        value1=header1.get(keyword),
+                        value2=header2.get(keyword),
+                        **location,
+                    )
+                )
+
+        # DATASUM is a 32-bit sum that does not see reordered bytes,
+        # so it can only show that the data differs, never that it is the same
+        datasum_differs = (
+            hdu1["datasum"] is not None
+            and hdu2["datasum"] is not None
+            and hdu1["datasum"] != hdu2["datasum"]
+        )
+        identical = (
+            not datasum_differs
+            and hdu1["data_size"] == hdu2["data_size"]
+            and hash_hdu_data(file1, hdu1["data_offset"], hdu1["data_size"])
+            == hash_hdu_data(file2, hdu2["data_offset"], hdu2["data_size"])
+        )
+        if identical:
+            continue
+        items = compare_hdu_data(file1, file2, index, rtol=rtol, atol=atol)
+        if items is None:
+            differences.append(
+                make_difference(
+                    filename, "data", detail="shape, type or columns differ", **location
+                )
+            )
+            continue
+        for item, n_different, n_rows, max_abs_diff, max_rel_diff in items:
+            differences.append(
+                make_difference(
+                    filename,
+                    "data",
+                    item=item,
+                    n_different=n_different,
+                    n_rows=n_rows,
+                    max_abs_diff=(
+                        None if np.isnan(max_abs_diff) else float(max_abs_diff)
+                    ),
+                    max_rel_diff=(
+                        None if np.isnan(max_rel_diff) else float(max_rel_diff)
+                    ),
+                    detail=f"{n_different} of {n_rows} rows differ",
+                    **location,
+                )
+            )
+    return differences
+
+
+def _compare_file_pair(pair):
+    file1, file2, rtol, atol = pair
+    return compare_fits_files_all_hdus(file1, file2, rtol=rtol, atol=atol)
+
+
+def compare_fits_folders_all_hdus(folder1, folder2, n_jobs=8, rtol=0.0, atol=0.0):
+    """
+    Compares every HDU of every FITS file in two folders, spread over n_jobs
+    processes, and returns a list of all the differences found (see
+    compare_fits_files_all_hdus). Files present in only one folder are listed
+    with kind "missing".
+
+    Example Code:
+
+    differences = compare_fits_folders_all_hdus(folder1, folder2, n_jobs=16, rtol=1e-6)
+    write_difference_report(differences, "differences.ecsv")
+    """
+    files1 = list_fits_files(folder1)
+    files2 = list_fits_files(folder2)
+    differences = []
+    for filename in sorted(set(files1) ^ set(files2)):
+        folder = folder2 if filename in files1 else folder1
+        differences.append(
+            make_difference(filename, "missing", detail=f"not in {folder}")
+        )
+    common = sorted(set(files1) & set(files2))
+    pairs = [
+        (os.path.join(folder1, filename), os.path.join(folder2, filename), rtol, atol)
+        for filename in common
+    ]
+    for file_differences in ParallelMap(_compare_file_pair, pairs, n_jobs=n_jobs):
+        differences.extend(file_differences)
+    return differences
+
+
+def json_safe(value):
+    """
+    value with the non-finite floats (e.g. an infinite max_rel_diff) replaced
+    by the strings "inf", "-inf" and "nan", which strict JSON readers accept.
+    """
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, (float, np.floating)) and not np.isfinite(value):
+        return str(float(value))
+    return value
+
+
+def write_difference_report(differences, path, meta=None):
+    """
+    Writes the differences as JSON (a list of records) or, for any other
+    extension, as an ECSV table with one row per difference. In JSON the
+    non-finite numbers are written as strings (see json_safe).
+    """
+    meta = meta or {}
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(
+                json_safe({"meta": meta, "differences": differences}),
+                f,
+                indent=1,
+                default=str,
+                allow_nan=False,
+            )
+        return
+    columns = {
+        "file": str,
+        "hdu": int,
+        "name": str,
+        "kind": str,
+        "item": str,
+        "value1": str,
+        "value2": str,
+        "n_different": int,
+        "n_rows": int,
+        "max_abs_diff": float,
+        "max_rel_diff": float,
+        "detail": str,
+    }
+    missing = {str: "", int: -1, float: np.nan}
+    table = Table(
+        {
+            name: np.array(
+                [
+                    missing[dtype] if d[name] is None else dtype(d[name])
+                    for d in differences
+                ],
+                dtype=dtype,
+            )
+            for name, dtype in columns.items()
+        }
+    )
+    table.meta.update(meta)
+    table.write(path, format="ascii.ecsv", overwrite=True)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Compare two folders of FITS files.",
@@ -104,5 +475,64 @@ if __name__ == "__main__":
         type=int,
         help="Length of the fits file to compare. (hdul[i]), default = 0",
     )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Compare every HDU (hashes first, data only where they differ)\nand report all differences instead of stopping at the first.",
+    )
+    parser.add_argument(
+        "--j",
+        default=8,
+        type=int,
+        help="Number of processes used with --all, default = 8",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        help="With --all, write the differences to this file (.json or .ecsv).",
+    )
+    parser.add_argument(
+        "--rtol",
+        default=0.0,
+        type=float,
+        help="With --all, float values within rtol are equal, default = 0",
+    )
+    parser.add_argument(
+        "--atol",
+        default=0.0,
+        type=float,
+        help="With --all, float values within atol are equal, default = 0",
+    )
     args = parser.parse_args()
-    compare_fits_folders(args.f1, args.f2, args.l)
+    if args.all:
+        differences = compare_fits_folders_all_hdus(
+            args.f1, args.f2, n_jobs=args.j, rtol=args.rtol, atol=args.atol
+        )
+        for difference in differences:
+            location = difference["file"]
+            if difference["hdu"] is not None:
+                location += f" [{difference['hdu']}] {difference['name']}"
+            if difference["kind"] == "header":
+                print(
+                    f"{location}: {difference['item']} = {difference['value1']!r} vs {difference['value2']!r}"
+                )
+            elif difference["kind"] == "data":
+                print(
+                    f"{location}: {difference['item']} {difference['detail']} (max abs diff {difference['max_abs_diff']}, max rel diff {difference['max_rel_diff']})"
+                )
+            else:
+                print(f"{location}: {difference['detail']}")
+        print(f"{len(differences)} differences found.")
+        if args.report:
+            write_difference_report(
+                differences,
+                args.report,
+                meta={
+                    "folder1": args.f1,
+                    "folder2": args.f2,
+                    "rtol": args.rtol,
+                    "atol": args.atol,
+                },
+            )
+    else:
+        compare_fits_folders(args.f1, args.f2, args.l)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+import os
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+from astropy.table import Table, vstack
+from VEGASStage6Log import parse_stage6_log
+from Parallel import ParallelMap
+
+
+def ReadManifest(path):
+    """
+    Manifest of the comparisons to run: a CSV with the columns
+    name, stage6_log, sed (the Spectrum/SED.ecsv written by DL3toDL5.py).
+    Relative paths are taken relative to the manifest.
+
+    Example manifest:
+        name,stage6_log,sed
+        Crab,logs/Crab_Stage6.log,Crab/Spectrum/SED.ecsv
+        M87,logs/M87_Stage6.log,M87/Spectrum/SED.ecsv
+    """
+    manifest = Table.read(path, format="ascii.csv")
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for column in ["stage6_log", "sed"]:
+        manifest[column] = [
+            os.path.join(base_dir, str(value)) for value in manifest[column]
+        ]
+    return manifest
+
+
+def ReadGammapySED(path):
+    """
+    dN/dE [cm-2 s-1 TeV-1] of the flux points in a SED.ecsv (likelihood format,
+    i.e. norm * ref_dnde) with the energy bins [TeV].
+    """
+    sed = Table.read(path, format="ascii.ecsv")
+    ref_dnde = sed["ref_dnde"].quantity.to_value("cm-2 s-1 TeV-1")
+    return {
+        "e_ref": sed["e_ref"].quantity.to_value("TeV"),
+        "e_min": sed["e_min"].quantity.to_value("TeV"),
+        "e_max": sed["e_max"].quantity.to_value("TeV"),
+        "dnde": np.asarray(sed["norm"]) * ref_dnde,
+        "dnde_err": np.asarray(sed["norm_err"]) * ref_dnde,
+        "is_ul": np.asarray(sed["is_ul"], dtype=bool),
+    }
+
+
+def MatchEnergyBins(e_min, e_max, energy):
+    """
+    Index of the gammapy bin [e_min, e_max) containing each energy, -1 if none.
+    The bins have to be sorted and not overlap.
+    """
+    index = np.searchsorted(e_min, energy, side="right") - 1
+    inside = (index >= 0) & (energy < e_max[np.clip(index, 0, None)])
+    return np.where(inside, index, -1)
+
+
+def CompareSpectra(name, stage6_log, sed_path):
+    """
+    Table of the energy bins with a flux point in both the VEGAS Stage 6 log
+    and the gammapy SED (upper limits on either side and VEGAS fluxes that are
+    not positive and finite are left out), with the
+    flux ratio gammapy / VEGAS and the pull (gammapy - VEGAS) / error.
+    """
+    points, _ = parse_stage6_log(stage6_log)
+    sed = ReadGammapySED(sed_path)
+    # Stage 6 fluxes are per m^2
+    vegas_flux = points["Flux"] / 10000
+    vegas_flux_err = points["Flux_error"] / 10000
+    index = MatchEnergyBins(sed["e_min"], sed["e_max"], points["Energy"])
+    # A zero or missing VEGAS flux has no ratio
+    vegas = np.flatnonzero(
+        (index >= 0)
+        & ~points["is_upper_limit"]
+        & np.isfinite(vegas_flux)
+        & (vegas_flux > 0)
+        & np.isfinite(vegas_flux_err)
+    )
+    index = index[vegas]
+    keep = (
+        ~sed["is_ul"][index]
+        & np.isfinite(sed["dnde"][index])
+        & np.isfinite(sed["dnde_err"][index])
+    )
+    vegas, index = vegas[keep], index[keep]
+
+    comparison = Table()
+    comparison["name"] = np.full(len(index), str(name))
+    comparison["e_min"] = sed["e_min"][index]
+    comparison["e_max"] = sed["e_max"][index]
+    comparison["e_ref"] = sed["e_ref"][index]
+    comparison["vegas_energy"] = points["Energy"][vegas]
+    comparison["vegas_dnde"] = vegas_flux[vegas]
+    comparison["vegas_dnde_err"] = vegas_flux_err[vegas]
+    comparison["gammapy_dnde"] = sed["dnde"][index]
+    comparison["gammapy_dnde_err"] = sed["dnde_err"][index]
+    comparison["ratio"] = comparison["gammapy_dnde"] / comparison["vegas_dnde"]
+    comparison["ratio_err"] = np.abs(comparison["ratio"]) * np.hypot(
+        comparison["gammapy_dnde_err"] / comparison["gammapy_dnde"],
+        comparison["vegas_dnde_err"] / comparison["vegas_dnde"],
+    )
+    comparison["pull"] = (
+        comparison["gammapy_dnde"] - comparison["vegas_dnde"]
+    ) / np.hypot(comparison["gammapy_dnde_err"], comparison["vegas_dnde_err"])
+    for column in ["e_min", "e_max", "e_ref", "vegas_energy"]:
+        comparison[column].unit = "TeV"
+    for column in ["vegas_dnde", "vegas_dnde_err", "gammapy_dnde", "gammapy_dnde_err"]:
+        comparison[column].unit = "cm-2 s-1 TeV-1"
+    return comparison
+
+
+def PlotComparison(comparison, filepath):
+    """
+    Flux points of both analyses (top) and the ratio gammapy / VEGAS (bottom).
+    """
+    fig, (ax1, ax2) = plt.subplots(
+        2,
+        1,
+        sharex=True,
+        gridspec_kw={"height_ratios": [10, 4]},
+        figsize=(8, 8),
+        tight_layout=True,
+    )
+    ax1.errorbar(
+        comparison["vegas_energy"],
+        comparison["vegas_dnde"],
+        yerr=comparison["vegas_dnde_err"],
+        linestyle="None",
+        marker=".",
+        capsize=3,
+        color="blue",
+        label="VEGAS",
+    )
+    ax1.errorbar(
+        comparison["e_ref"],
+        comparison["gammapy_dnde"],
+        xerr=[
+            comparison["e_ref"] - comparison["e_min"],
+            comparison["e_max"] - comparison["e_ref"],
+        ],
+        yerr=comparison["gammapy_dnde_err"],
+        linestyle="None",
+        marker=".",
+        capsize=3,
+        color="red",
+        label="Gammapy",
+    )
+    ax1.set_xscale("log")
+    ax1.set_yscale("log")
+    ax1.set_ylabel(
+        r"dN/dE $\left[\frac{1}{\text{cm}^2 \, \text{s} \, \text{TeV}}\right]$"
+    )
+    ax1.set_title(comparison["name"][0] if len(comparison) else "")
+    ax1.legend()
+    ax2.errorbar(
+        comparison["e_ref"],
+        comparison["ratio"],
+        yerr=comparison["ratio_err"],
+        linestyle="None",
+        marker=".",
+        capsize=3,
+        color="black",
+    )
+    ax2.axhline(1, color="grey")
+    ax2.set_xlabel("Energy [TeV]")
+    ax2.set_ylabel("Gammapy / VEGAS")
+    fig.savefig(filepath)
+    plt.close(fig)
+    return filepath
+
+
+def _PlotComparisonWorker(item):
+    comparison, filepath = item
+    return PlotComparison(comparison, filepath)
+
+
+def PlotPulls(comparisons, filepath):
+    pulls = np.asarray(comparisons["pull"])
+    fig, ax = plt.subplots()
+    # Pulls beyond +-5 go into the edge bins, so every bin in the title is shown
+    bins = np.linspace(-5, 5, 41)
+    ax.hist(
+        np.clip(pulls, bins[0], bins[-1]), bins=bins, histtype="step", color="black"
+    )
+    ax.set_xlabel("(Gammapy - VEGAS) / error")
+    ax.set_ylabel("Number of bins")
+    ax.set_title(
+        f"{len(pulls)} bins: mean {np.mean(pulls):.2f}, std {np.std(pulls):.2f}"
+    )
+    fig.savefig(filepath)
+    plt.close(fig)
+
+
+def CompareVEGASGammapy(manifest_path, output_dir, n_jobs=1):
+    """
+    Runs CompareSpectra for every row of the manifest and writes to output_dir:
+      Comparison.ecsv  all matched bins of all sources
+      Summary.ecsv     per source: number of bins, mean ratio, mean and std of the pulls
+      <name>.pdf       comparison plot per source (rendered on n_jobs processes)
+      Pulls.pdf        pull distribution of all bins
+    Returns (comparisons, summary)
+
+    Example usage:
+        python CompareVEGASGammapy.py manifest.csv -Output VEGASComparison -NJobs 8
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = ReadManifest(manifest_path)
+    per_source = [
+        CompareSpectra(row["name"], row["stage6_log"], row["sed"]) for row in manifest
+    ]
+    ParallelMap(
+        _PlotComparisonWorker,
+        [
+            (comparison, os.path.join(output_dir, f"{name}.pdf"))
+            for comparison, name in zip(per_source, manifest["name"])
+        ],
+        n_jobs=n_jobs,
+    )
+
+    comparisons = vstack(per_source)
+    comparisons.write(
+        os.path.join(output_dir, "Comparison.ecsv"), format="ascii.ecsv", overwrite=True
+    )
+    summary = Table(
+        rows=[
+            (
+                str(name),
+                len(comparison),
+                np.mean(comparison["ratio"]) if len(comparison) else np.nan,
+                np.mean(comparison["pull"]) if len(comparison) else np.nan,
+                np.std(comparison["pull"]) if len(comparison) else np.nan,
+            )
+            for comparison, name in zip(per_source, manifest["name"])
+        ],
+        names=("name", "n_bins", "mean_ratio", "mean_pull", "std_pull"),
+        dtype=(str, int, float, float, float),
+    )
+    summary.write(
+        os.path.join(output_dir, "Summary.ecsv"), format="ascii.ecsv", overwrite=True
+    )
+    PlotPulls(comparisons, os.path.join(output_dir, "Pulls.pdf"))
+    return comparisons, summary
+
+
+if __name__ == "__main__":
+    import matplotlib
+
+    matplotlib.use("Agg")
+    parser = argparse.ArgumentParser(
+        description="Compare the VEGAS Stage 6 and gammapy flux points of many sources."
+    )
+    parser.add_argument(
+        "Manifest", help="CSV with the columns name, stage6_log, sed (SED.ecsv)."
+    )
+    parser.add_argument("-Output", help="Output directory.", default="VEGASComparison")
+    parser.add_argument(
+        "-NJobs", help="Number of plots rendered at a time.", type=int, default=1
+    )
+    args = parser.parse_args()
+
+    comparisons, summary = CompareVEGASGammapy(
+        args.Manifest, args.Output, n_jobs=args.NJobs
+    )
+    summary.pprint(max_lines=-1, max_width=-1)
+    print(f"Wrote the comparison of {len(summary)} sources to {args.Output}.")
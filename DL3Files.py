@@ -0,0 +1,18 @@
+import os
+
+
+def FindDL3Files(dl3_path):
+    """
+    FITS files below dl3_path (relative paths, sorted), without the index files.
+    Only uses os, so header-only utilities can import it without the gammapy stack.
+    """
+    files = []
+    for root, dirs, filenames in os.walk(dl3_path):
+        dirs.sort()
+        for filename in filenames:
+            if not filename.lower().endswith((".fits", ".fits.gz", ".fit", ".fz")):
+                continue
+            if filename.startswith(("hdu-index.", "obs-index.", ".")):
+                continue
+            files.append(os.path.relpath(os.path.join(root, filename), dl3_path))
+    return sorted(files)
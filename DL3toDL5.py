@@ -31,6 +31,7 @@ import sys
 script_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(script_dir)
 from importer import *
+from RunLogger import StartRunLogger, PeakRSS
 from AddArguments import get_parser, CheckAllowedSpectralModelInputted
 from WriteLogFile import (
     WritePackageVersionsToLog,
@@ -44,21 +45,26 @@ from Diagnostics import (
     DiagnosticsPointingOffsetDistribution,
     DiagnosticsPeekAtIRFs,
     DiagnosticsPeekAtEvents,
+    StartDiagnosticsRenderer,
+    ReductionJobs,
+    WaitForDiagnosticsRenderer,
     check_livetimes,
     SaveInfoTable,
     PlotOnOffEvents,
 )
 from EnergyAxes import EnergyAxes
 from GetGeometry import (
-    GetOnRegion,
-    GetExclusionRegions,
-    GetExclusionMask,
+    GetGeometryAndExclusionMask,
     GetOnRegionRadius,
 )
-from DataReduction import RunDataReductionChain
+from DataReduction import (
+    RunDataReductionChain,
+    MakeReducedDatasets,
+    GetSafeAndNotSafeRunStats,
+)
 from SpectralVariabilityPlots import MakeSpectralVariabilityPlots
 from LightCurve import MakeLightCurve
-from Spectrum import SpectrumTimeBins
+from Spectrum import SpectrumTimeBins, RunTimeBins
 
 args = get_parser().parse_args()
 CheckAllowedSpectralModelInputted(args)
@@ -78,45 +84,43 @@ if args.LightCurve == True:
 if args.SpectralVariabilityTimeBinFile is not None:
     os.makedirs(args.ADir + "/SpectralVariability", exist_ok=True)
 path_to_log = args.ADir + "/log.txt"
-with open(path_to_log, "w") as f:
+logger = StartRunLogger(path_to_log, start_time=script_start_time)
+with logger as f:
     f.write("Log file for DL3toDL5.py\n")
     f.write("Author: Nicki Bond\n")
     f.write("Date Run: " + str(datetime.now()) + "\n")
     f.write(f"Command line arguments: \n{cmd_line_args}\n")
     f.write("--------------------------------------------------\n")
 WritePackageVersionsToLog(path_to_log)
-WriteInputParametersToLog(path_to_log)
+WriteInputParametersToLog(path_to_log, args)
 ########################################
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Initial Steps Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Initial Steps")
 
 ############# Select Data #############
 # Select data from the DL3Path directory
 # Select data based on the run list, run exclude list, object name, and date range
 # Select target position
-obs_table, observations, target_position, obs_ids = SelectRuns(path_to_log, args)
+obs_table, observations, target_position, obs_ids, data_store = SelectRuns(
+    path_to_log, args
+)
 ########################################
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Select Data Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Select Data")
 
 ###### Initial Debugging Plots #######
 DiagnosticsTotalTimeStats(path_to_log, obs_table, args)
 DiagnosticsDeadtimeDistribution(path_to_log, obs_table, args)
 DiagnosticsPointingOffsetDistribution(path_to_log, obs_table, args)
-DiagnosticsPeekAtIRFs(path_to_log, observations, args)
-DiagnosticsPeekAtEvents(path_to_log, observations, args)
+# The IRF and event peek plots are made in the background, we only wait for them at the end
+diagnostics_renderer = StartDiagnosticsRenderer(observations, args)
+DiagnosticsPeekAtIRFs(path_to_log, observations, args, renderer=diagnostics_renderer)
+DiagnosticsPeekAtEvents(path_to_log, observations, args, renderer=diagnostics_renderer)
+if diagnostics_renderer is not None:
+    diagnostics_renderer.start()
 ########################################
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Initial Debugging Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Initial Debugging")
 
 
 ########## Define Energy Axes  ##########
@@ -130,20 +134,31 @@ energy_axis, energy_axis_true = EnergyAxes(args, path_to_log)
 # Define the on region
 # Define exclusion regions
 on_region_radius = GetOnRegionRadius(args, path_to_log)
-on_region, geom = GetOnRegion(
+# These are read from the cache if this target was set up before with the same inputs
+on_region, geom, exclusion_regions, exclusion_mask = GetGeometryAndExclusionMask(
     target_position, args, energy_axis, path_to_log, on_region_radius
 )
-exclusion_regions = GetExclusionRegions(target_position, args, path_to_log)
-exclusion_mask = GetExclusionMask(exclusion_regions, target_position, energy_axis)
 ##############################################
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Energy Axis and Define Geometry Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Energy Axis and Define Geometry")
 
 ########### Data Reduction Chain: Significance and Spectrum ############
 # Note this is done with whole dataset (i.e. before we remove areas with higher systematics)
+# The per-run datasets are reduced once here and reused for the time bins below
+all_datasets, masks_not_safe = MakeReducedDatasets(
+    geom,
+    energy_axis_true,
+    exclusion_mask,
+    observations,
+    obs_ids,
+    path_to_log,
+    args,
+    data_store=data_store,
+    # The reduction pools get the processes the renderer does not use
+    n_jobs=ReductionJobs(diagnostics_renderer, args),
+)
+# Per-run counts, livetime etc., shared by the significance plots and the diagnostics below
+run_stats, run_stats_not_safe = GetSafeAndNotSafeRunStats(all_datasets, masks_not_safe)
 fit_results_full_dataset, all_datasets = RunDataReductionChain(
     geom,
     energy_axis,
@@ -154,73 +169,54 @@ fit_results_full_dataset, all_datasets = RunDataReductionChain(
     path_to_log,
     args,
     on_region_radius,
+    datasets=all_datasets,
+    masks_not_safe=masks_not_safe,
+    run_stats=run_stats,
+    run_stats_not_safe=run_stats_not_safe,
 )
 #########################################################
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Data Reduction Chain Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Data Reduction Chain")
 
 ####### Check Livetimes between obs_table and info_table
-check_livetimes(obs_table, all_datasets, observations, path_to_log)
+check_livetimes(obs_table, run_stats, observations, path_to_log, args)
 ###### Check info_table
 info_table_not_cumulative = SaveInfoTable(all_datasets, args)
 PlotOnOffEvents(info_table_not_cumulative, args, path_to_log)
 ########################################################
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Check Livetimes between obs_table and info_table Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Check Livetimes between obs_table and info_table")
 
 # Run Data Reduction Chain for each time bin if specified
+# The time bins reuse the per-run datasets from the full dataset, only the fit, flux points and plots are redone
+# With -NJobs > 1 the time bins are run in parallel
 fit_results = []
+fit_time_bins = []
 if args.SpectralVariabilityTimeBinFile is not None:
-    with open(path_to_log, "a") as f:
+    with logger as f:
         f.write("--------------------------------------------------\n")
-        time_bins = SpectrumTimeBins(args)
-        for i, (tmin, tmax) in enumerate(time_bins):
-            f.write(
-                f"Running Data Reduction Chain for observations from {tmin} to {tmax}\n"
-            )
-            label = f"timebin_{i}"
-            selected_obs = [
-                obs
-                for obs in observations
-                if obs.tstart.mjd >= tmin and obs.tstart.mjd <= tmax
-                # if an observation crosses the time bin edge we include it in first time bin (i.e. we look at tstart not tstop)
-            ]
-            selected_obs_ids = [obs.obs_id for obs in selected_obs]
-            if len(selected_obs) == 0:
-                with open(path_to_log, "a") as f:
-                    f.write(
-                        f"Skipping {label}: no observations in MJD range {tmin}-{tmax}\n"
-                    )
-                continue
-            fit_result, dataset = RunDataReductionChain(
-                geom,
-                energy_axis,
-                energy_axis_true,
-                exclusion_mask,
-                selected_obs,
-                selected_obs_ids,
-                path_to_log,
-                args,
-                on_region_radius,
-                tmin=tmin,
-                tmax=tmax,
-            )[0]
-            fit_results.append(fit_result)
+    time_bins = SpectrumTimeBins(args)
+    fit_results, fit_time_bins = RunTimeBins(
+        time_bins,
+        all_datasets,
+        masks_not_safe,
+        run_stats,
+        run_stats_not_safe,
+        geom,
+        energy_axis,
+        energy_axis_true,
+        exclusion_mask,
+        path_to_log,
+        args,
+        on_region_radius,
+        n_jobs=ReductionJobs(diagnostics_renderer, args),
+    )
     ######### Look for Spectral Variability ##########
-    MakeSpectralVariabilityPlots(fit_results, time_bins, path_to_log, args)
+    MakeSpectralVariabilityPlots(fit_results, fit_time_bins, path_to_log, args)
     # flux_points_dataset, stacked, info_table, fit_result, datasets =MakeSpectrumFluxPoints(observations = observations, geom=geom, energy_axis=energy_axis, energy_axis_true=energy_axis_true, on_region=on_region, exclusion_mask=exclusion_mask, args = args, path_to_log=path_to_log)
     # PlotSpectrum(flux_points_dataset, args= args, path_to_log=path_to_log)
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Data Reduction Chain for Individual Time Bins Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Data Reduction Chain for Individual Time Bins")
 
 ######### Integral Flux ############
 # Find integral flux for the source
@@ -230,14 +226,11 @@ with open(path_to_log, "a") as f:
 # Note that this is handled for both the case where there are multiple time bins and where there is only one time bin
 WriteIntegralFluxToLog(fit_results_full_dataset, args, path_to_log)
 if fit_results != []:
-    for fit_result, (tmin, tmax) in zip(fit_results, time_bins):
+    for fit_result, (tmin, tmax) in zip(fit_results, fit_time_bins):
         WriteIntegralFluxToLog(fit_result, args, path_to_log, tmin=tmin, tmax=tmax)
 ############################################
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Find Integral Flux Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Find Integral Flux")
 
 
 ######### Make Light Curve ############
@@ -249,19 +242,24 @@ if args.LightCurve == True:
     lc = MakeLightCurve(path_to_log=path_to_log, datasets=all_datasets, args=args)
 ##############################################
 
-with open(path_to_log, "a") as f:
-    f.write(
-        f"Make Light Curve Complete Time stamp: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+logger.StageComplete("Make Light Curve")
+
 
+WaitForDiagnosticsRenderer(diagnostics_renderer, path_to_log)
 
 ######### Write End of Log File ##########
-with open(path_to_log, "a") as f:
+logger.StageComplete("Diagnostics Plots")
+with logger as f:
     f.write("--------------------------------------------------\n")
-    f.write(
-        f"Script Runtime: {((time.time() - script_start_time) / 60):.2f} minutes \n"
-    )
+    f.write(f"Script Runtime: {(logger.RunTime() / 60):.2f} minutes \n")
     f.write("--------------------------------------------------\n")
+logger.Event(
+    "run",
+    wall_s=round(logger.RunTime(), 3),
+    cpu_s=round(time.process_time(), 3),
+    **PeakRSS(),
+)
+logger.flush()
 print("\nAnalysis complete. Log file written to: " + path_to_log + "\n")
-print(f"Script Runtime: {((time.time() - script_start_time) / 60):.2f} minutes \n")
+print(f"Script Runtime: {(logger.RunTime() / 60):.2f} minutes \n")
 #################################################
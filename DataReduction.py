@@ -1,6 +1,10 @@
 from importer import *
-from GetGeometry import GetOnRegionRadius
+from RunLogger import GetRunLogger
 from GetGeometry import read_exclusion_csv
+from Parallel import ParallelMap, GetShared
+from Cache import GetCacheDir
+from DatasetCache import GetDatasetCacheKeys, ReadCachedDataset, WriteCachedDataset
+from DatasetStats import GetRunStats, GetCumulativeStats
 
 
 def RunDataReductionChain(
@@ -13,9 +17,21 @@ def RunDataReductionChain(
     path_to_log,
     args,
     on_region_radius,
+    data_store=None,
     tmin=None,
     tmax=None,
+    datasets=None,
+    masks_not_safe=None,
+    run_stats=None,
+    run_stats_not_safe=None,
 ):
+    """
+    Significance plots, on/off region plot, fit and flux points.
+    datasets and masks_not_safe are as returned by MakeReducedDatasets; if
+    datasets is None the observations are reduced first.
+    run_stats and run_stats_not_safe are as returned by GetSafeAndNotSafeRunStats
+    and are computed here if not given.
+    """
     if tmin is not None and tmax is not None:
         WorkingDir = os.path.join(
             args.ADir, f"SpectralVariability/TimeBin_{tmin}_{tmax}"
@@ -28,61 +44,40 @@ def RunDataReductionChain(
     os.makedirs(WorkingDir + "/Diagnostics", exist_ok=True)
     os.makedirs(WorkingDir + "/Spectrum", exist_ok=True)
 
-    dataset_maker = SpectrumDatasetMaker(selection=["counts", "exposure", "edisp"])
-    dataset_empty = SpectrumDataset.create(geom=geom, energy_axis_true=energy_axis_true)
-    if args.BackgroundMaker == "ReflectedRegions":
-        bkg_maker = ReflectedRegionsBackgroundMaker(exclusion_mask=exclusion_mask)
-    else:
-        raise ValueError(
-            f"Unknown Background Maker: {args.BackgroundMaker}. Choose 'ReflectedRegions'."
+    if datasets is None:
+        datasets, masks_not_safe = MakeReducedDatasets(
+            geom,
+            energy_axis_true,
+            exclusion_mask,
+            observations,
+            obs_ids,
+            path_to_log,
+            args,
+            data_store=data_store,
         )
-    safe_mask_maker = SafeMaskMaker(
-        methods=["offset-max", "aeff-max", "edisp-bias"],
-        offset_max=1.75 * u.deg,
-        aeff_percent=5,
-        bias_percent=5,
-    )
-    """
-    datasets_not_safe = Datasets()
-    datasets = Datasets()
-    for obs_id, observation in zip(obs_ids, observations):
-        dataset = dataset_maker.run(dataset_empty.copy(name=str(obs_id)), observation)
-        dataset_on_off = bkg_maker.run(dataset, observation)
-        datasets_not_safe.append(dataset_on_off)
-        dataset_on_off = safe_mask_maker.run(dataset_on_off, observation)
-        datasets.append(dataset_on_off)
-        plt.figure()
-
-    # Significance Calculation
-    CalculateAndPlotSignificanceAndExcess(datasets_not_safe, path_to_log, WorkingDir, args, tmin=tmin, tmax=tmax, safe=False)
-    CalculateAndPlotSignificanceAndExcess(datasets, path_to_log, WorkingDir, args, tmin=tmin, tmax=tmax, safe=True)
-    """
-    datasets = Datasets()
-    for obs_id, observation in zip(obs_ids, observations):
-        dataset = dataset_maker.run(dataset_empty.copy(name=str(obs_id)), observation)
-        dataset_on_off = bkg_maker.run(dataset, observation)
-        datasets.append(dataset_on_off)
     # Significance Calculation
+    if run_stats is None or run_stats_not_safe is None:
+        run_stats, run_stats_not_safe = GetSafeAndNotSafeRunStats(
+            datasets, masks_not_safe
+        )
     CalculateAndPlotSignificanceAndExcess(
-        datasets, path_to_log, WorkingDir, args, tmin=tmin, tmax=tmax, safe=False
+        run_stats_not_safe,
+        path_to_log,
+        WorkingDir,
+        args,
+        tmin=tmin,
+        tmax=tmax,
+        safe=False,
     )
-    datasets = Datasets()
-    for obs_id, observation in zip(obs_ids, observations):
-        dataset = dataset_maker.run(dataset_empty.copy(name=str(obs_id)), observation)
-        dataset_on_off = bkg_maker.run(dataset, observation)
-        dataset_on_off = safe_mask_maker.run(dataset_on_off, observation)
-        datasets.append(dataset_on_off)
-    # Significance Calculation
     CalculateAndPlotSignificanceAndExcess(
-        datasets, path_to_log, WorkingDir, args, tmin=tmin, tmax=tmax, safe=True
+        run_stats, path_to_log, WorkingDir, args, tmin=tmin, tmax=tmax, safe=True
     )
 
     plt.figure()
     # Plot on and off regions
     ax = exclusion_mask.plot()
-    on_region_radius = GetOnRegionRadius(args, path_to_log)
-    obj_coord = SkyCoord.from_name(args.ObjectName).icrs
-    on_region = CircleSkyRegion(center=obj_coord, radius=on_region_radius)
+    on_region = geom.region
+    obj_coord = on_region.center
 
     on_region.to_pixel(ax.wcs).plot(ax=ax, color="lime")
     if args.NameSourceInOnOffRegionPlot:
@@ -99,20 +94,19 @@ def RunDataReductionChain(
     plot_spectrum_datasets_off_regions(ax=ax, datasets=datasets)
     plt.legend(["On Region"])
     if args.exclusion_csv is not None:
-        _, table = read_exclusion_csv(args.exclusion_csv)
-        for row in table:
-            coord = SkyCoord(row["ra"], row["dec"], unit="deg", frame="icrs")
-            x, y = coord.to_pixel(ax.wcs)
-            if row["name"]:
-                ax.annotate(
-                    row["name"],
-                    xy=(x, y),
-                    xycoords="data",
-                    xytext=(10, 10),
-                    textcoords="offset points",
-                    color="red",
-                    fontsize=12,
-                )
+        table = read_exclusion_csv(args.exclusion_csv)
+        table = table[table["name"] != ""]
+        coords = SkyCoord(table["ra"], table["dec"], unit="deg", frame="icrs")
+        for name, x, y in zip(table["name"], *coords.to_pixel(ax.wcs)):
+            ax.annotate(
+                name,
+                xy=(x, y),
+                xycoords="data",
+                xytext=(10, 10),
+                textcoords="offset points",
+                color="red",
+                fontsize=12,
+            )
 
     if tmin is not None and tmax is not None:
         plt.title(f"Exclusion Regions from {tmin} to {tmax}")
@@ -126,7 +120,7 @@ def RunDataReductionChain(
 
     spectral_model = BuildModel(args)
     model = SkyModel(spectral_model=spectral_model, name=str(args.ObjectName))
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("Initial Model Parameters \n")
         f.write("Model: " + str(model) + "\n")
         f.write("Spectral Model: " + str(args.SpectralModel) + "\n")
@@ -149,7 +143,7 @@ def RunDataReductionChain(
     datasets.models = [model]
     fit = Fit()
     fit_result = fit.run(datasets=datasets)
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         if tmin is not None and tmax is not None:
             f.write(f"Results for time bin {tmin} to {tmax}\n")
         if fit_result.success != True:
@@ -178,19 +172,155 @@ def RunDataReductionChain(
     flux_points_dataset = FluxPointsDataset(data=flux_points, models=datasets.models)
     plot_success = safe_plot_fit(flux_points_dataset, WorkingDir=WorkingDir, args=args)
     if plot_success:
-        with open(path_to_log, "a") as f:
+        with GetRunLogger(path_to_log) as f:
             f.write("Plot generated successfully.\n")
             f.write(
                 f"Saved SED plot to {WorkingDir}/Spectrum/Spectrum_FluxPoints.pdf\n"
             )
     else:
-        with open(path_to_log, "a") as f:
+        with GetRunLogger(path_to_log) as f:
             f.write(
                 f"Failed to generate plot {WorkingDir}/Spectrum/Spectrum_FluxPoints.pdf. Continuing...\n"
             )
     return fit_result, datasets
 
 
+def MakeReducedDatasets(
+    geom,
+    energy_axis_true,
+    exclusion_mask,
+    observations,
+    obs_ids,
+    path_to_log,
+    args,
+    data_store=None,
+    n_jobs=None,
+):
+    """
+    Reduce each observation to an ON/OFF dataset, on n_jobs processes
+    (default -NJobs).
+    Returns the Datasets (safe masks applied) and a dict of the masks from
+    before the safe mask maker, keyed by dataset name.
+    """
+    dataset_maker = SpectrumDatasetMaker(selection=["counts", "exposure", "edisp"])
+    dataset_empty = SpectrumDataset.create(geom=geom, energy_axis_true=energy_axis_true)
+    if args.BackgroundMaker == "ReflectedRegions":
+        bkg_maker = ReflectedRegionsBackgroundMaker(exclusion_mask=exclusion_mask)
+    else:
+        raise ValueError(
+            f"Unknown Background Maker: {args.BackgroundMaker}. Choose 'ReflectedRegions'."
+        )
+    safe_mask_maker = SafeMaskMaker(
+        methods=["offset-max", "aeff-max", "edisp-bias"],
+        offset_max=1.75 * u.deg,
+        aeff_percent=5,
+        bias_percent=5,
+    )
+    # Runs that were reduced with the same inputs before are read from the cache
+    products = [None] * len(obs_ids)
+    cache_dir = GetCacheDir(args, "Datasets") if data_store is not None else None
+    if cache_dir is not None:
+        cache_keys = GetDatasetCacheKeys(
+            data_store,
+            obs_ids,
+            geom,
+            energy_axis_true,
+            exclusion_mask,
+            dataset_maker,
+            bkg_maker,
+            safe_mask_maker,
+            cache_dir,
+        )
+        for i, obs_id in enumerate(obs_ids):
+            products[i] = ReadCachedDataset(cache_dir, cache_keys[i], str(obs_id))
+    to_reduce = [i for i, product in enumerate(products) if product is None]
+    if cache_dir is not None:
+        with GetRunLogger(path_to_log) as f:
+            f.write(
+                f"Reduced datasets read from cache {cache_dir}: {len(obs_ids) - len(to_reduce)} of {len(obs_ids)} runs\n"
+            )
+    reduced = ParallelMap(
+        _ReduceObservationWorker,
+        to_reduce,
+        n_jobs=args.NJobs if n_jobs is None else n_jobs,
+        shared=dict(
+            observations=observations,
+            obs_ids=obs_ids,
+            dataset_empty=dataset_empty,
+            dataset_maker=dataset_maker,
+            bkg_maker=bkg_maker,
+            safe_mask_maker=safe_mask_maker,
+        ),
+    )
+    for i, product in zip(to_reduce, reduced):
+        products[i] = product
+        if cache_dir is not None:
+            WriteCachedDataset(cache_dir, cache_keys[i], *product)
+
+    datasets = Datasets()
+    masks_not_safe = {}
+    for dataset_on_off, mask_not_safe in products:
+        datasets.append(dataset_on_off)
+        masks_not_safe[dataset_on_off.name] = mask_not_safe
+    return datasets, masks_not_safe
+
+
+def ReduceObservation(
+    observation, obs_id, dataset_empty, dataset_maker, bkg_maker, safe_mask_maker
+):
+    """
+    Make the ON/OFF dataset for a single run.
+    Returns the dataset with the safe mask applied and a copy of the mask from
+    before the safe mask maker was run (SafeMaskMaker updates the mask in place).
+    """
+    dataset = dataset_maker.run(dataset_empty.copy(name=str(obs_id)), observation)
+    dataset_on_off = bkg_maker.run(dataset, observation)
+    mask_not_safe = dataset_on_off.mask_safe.copy()
+    dataset_on_off = safe_mask_maker.run(dataset_on_off, observation)
+    return dataset_on_off, mask_not_safe
+
+
+def _ReduceObservationWorker(index):
+    # Runs in a ParallelMap worker, see MakeReducedDatasets
+    shared = GetShared()
+    return ReduceObservation(
+        shared["observations"][index],
+        shared["obs_ids"][index],
+        shared["dataset_empty"],
+        shared["dataset_maker"],
+        shared["bkg_maker"],
+        shared["safe_mask_maker"],
+    )
+
+
+def GetSafeAndNotSafeRunStats(datasets, masks_not_safe):
+    """
+    Per-run stats (see DatasetStats.GetRunStats) with the safe mask applied and
+    with the masks from before the safe mask maker.
+    """
+    run_stats = GetRunStats(datasets)
+    # The safe mask is only a boolean overlay on the ON/OFF dataset, so the
+    # "NotSafe" view is the same datasets with the pre-safe-mask mask swapped in.
+    masks_safe = SwapSafeMasks(datasets, masks_not_safe)
+    try:
+        run_stats_not_safe = GetRunStats(datasets)
+    finally:
+        SwapSafeMasks(datasets, masks_safe)
+    return run_stats, run_stats_not_safe
+
+
+def SwapSafeMasks(datasets, masks):
+    """
+    Replace the mask_safe of each dataset with masks[dataset.name].
+    Returns the masks that were replaced so they can be swapped back.
+    """
+    replaced = {}
+    for dataset in datasets:
+        replaced[dataset.name] = dataset.mask_safe
+        dataset.mask_safe = masks[dataset.name]
+    return replaced
+
+
 def safe_plot_fit(flux_points_dataset, WorkingDir, args):
     fig, (ax1, ax2) = plt.subplots(
         2,
@@ -293,10 +423,10 @@ def BuildModel(args):
 
 
 def CalculateAndPlotSignificanceAndExcess(
-    datasets, path_to_log, WorkingDir, args, tmin=None, tmax=None, safe=True
+    run_stats, path_to_log, WorkingDir, args, tmin=None, tmax=None, safe=True
 ):
-    info_table = datasets.info_table(cumulative=True)
-    with open(path_to_log, "a") as f:
+    info_table = GetCumulativeStats(run_stats)
+    with GetRunLogger(path_to_log) as f:
         if tmin is None and tmax is None:
             f.write("Significance and Excess for all observations")
 
@@ -332,7 +462,7 @@ def CalculateAndPlotSignificanceAndExcess(
     ax_sqrt_ts.set_title("Significance")
     ax_sqrt_ts.set_xlabel("Livetime [h]")
     ax_sqrt_ts.set_ylabel(r"Significance [$\sigma$]")
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         if safe:
             plt.savefig(WorkingDir + "/Spectrum/SignificanceAndExcess_Safe.pdf")
             f.write(
@@ -0,0 +1,88 @@
+from importer import *
+from Cache import HashItems, HashFiles
+from SelectRuns import GetRunFiles
+
+
+def GetDatasetCacheKeys(
+    data_store,
+    obs_ids,
+    geom,
+    energy_axis_true,
+    exclusion_mask,
+    dataset_maker,
+    bkg_maker,
+    safe_mask_maker,
+    cache_dir,
+):
+    """
+    One key per run for the reduced ON/OFF dataset cache.
+    A key changes if the run's DL3 files, the on region, the energy axes,
+    the exclusion mask or any of the maker settings change.
+    """
+    settings = HashItems(
+        gammapy.__version__,
+        geom.region.serialize(format="ds9"),
+        geom.axes["energy"].edges.to_value("TeV"),
+        energy_axis_true.edges.to_value("TeV"),
+        str(exclusion_mask.geom.wcs.to_header_string()),
+        exclusion_mask.data,
+        sorted(dataset_maker.selection),
+        bkg_maker.__class__.__name__,
+        sorted(safe_mask_maker.methods),
+        safe_mask_maker.offset_max,
+        safe_mask_maker.aeff_percent,
+        safe_mask_maker.bias_percent,
+    )
+    keys = []
+    for obs_id in obs_ids:
+        run_files = GetRunFiles(data_store, obs_id)
+        keys.append(
+            HashItems(settings, obs_id, HashFiles(run_files, cache_dir=cache_dir))
+        )
+    return keys
+
+
+def ReadCachedDataset(cache_dir, key, name):
+    """
+    Returns (dataset, mask_not_safe) as made by DataReduction.ReduceObservation,
+    or None if the run is not in the cache.
+    """
+    dataset_path = os.path.join(cache_dir, f"{key}.fits")
+    extra_path = os.path.join(cache_dir, f"{key}_extra.npz")
+    if not (os.path.exists(dataset_path) and os.path.exists(extra_path)):
+        return None
+    from astropy.io.misc import yaml
+
+    with np.load(extra_path) as extra:
+        # Entries written before the dataset meta data was stored are remade
+        if "meta" not in extra:
+            return None
+        dataset = SpectrumDatasetOnOff.read(dataset_path, format="gadf", name=name)
+        # The gadf format does not store the dataset and exposure meta data
+        dataset.meta = type(dataset.meta)(**yaml.load(str(extra["meta"])))
+        dataset.exposure.meta["livetime"] = float(extra["livetime"]) * u.s
+        dataset.exposure.meta["is_pointlike"] = bool(extra["is_pointlike"])
+        mask_not_safe = Map.from_geom(
+            dataset.mask_safe.geom, data=extra["mask_not_safe"], dtype=bool
+        )
+    return dataset, mask_not_safe
+
+
+def WriteCachedDataset(cache_dir, key, dataset, mask_not_safe):
+    dataset_path = os.path.join(cache_dir, f"{key}.fits")
+    extra_path = os.path.join(cache_dir, f"{key}_extra.npz")
+    from astropy.io.misc import yaml
+
+    # Write then rename so that a reader never sees a partly written file
+    with open(f"{extra_path}.{os.getpid()}.tmp", "wb") as f:
+        np.savez(
+            f,
+            # astropy's YAML keeps the Time and SkyCoord values of the meta data
+            meta=yaml.dump(dataset.meta.model_dump()),
+            livetime=dataset.exposure.meta["livetime"].to_value("s"),
+            is_pointlike=dataset.exposure.meta.get("is_pointlike", False),
+            mask_not_safe=mask_not_safe.data,
+        )
+    os.replace(f"{extra_path}.{os.getpid()}.tmp", extra_path)
+    dataset.write(f"{dataset_path}.{os.getpid()}.tmp", overwrite=True, format="gadf")
+    os.replace(f"{dataset_path}.{os.getpid()}.tmp", dataset_path)
@@ -0,0 +1,45 @@
+from importer import *
+from LiMaSignificance import LMS
+
+
+def GetRunStats(datasets):
+    """
+    Per-run summary of the ON/OFF datasets (the non-cumulative Datasets.info_table,
+    in the safe energy range). This is computed once and shared by the diagnostics;
+    cumulative values are derived from it with GetCumulativeStats.
+    """
+    return datasets.info_table(cumulative=False)
+
+
+def SelectRunStats(run_stats, names):
+    """
+    Rows of run_stats for the datasets called names, in that order.
+    """
+    index = dict(zip(run_stats["name"], range(len(run_stats))))
+    return run_stats[[index[name] for name in names]]
+
+
+def GetCumulativeStats(run_stats):
+    """
+    Livetime, counts, counts_off, background, excess, alpha and sqrt_ts (Li & Ma)
+    after each run, as Datasets.info_table(cumulative=True) would give them,
+    but from running sums instead of re-stacking the datasets for every prefix.
+    """
+    counts = np.cumsum(np.asarray(run_stats["counts"], dtype=int))
+    counts_off = np.cumsum(np.asarray(run_stats["counts_off"], dtype=int))
+    # The background is alpha * counts_off, summed bin by bin over each run
+    background = np.cumsum(np.asarray(run_stats["background"], dtype=float))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = background / counts_off
+    return Table(
+        {
+            "name": run_stats["name"],
+            "livetime": np.cumsum(u.Quantity(run_stats["livetime"]).to("s")),
+            "counts": counts,
+            "counts_off": counts_off,
+            "background": background,
+            "excess": counts - background,
+            "alpha": alpha,
+            "sqrt_ts": LMS(counts, counts_off, alpha),
+        }
+    )
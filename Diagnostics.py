@@ -1,8 +1,11 @@
 from importer import *
+import queue
+from RunLogger import GetRunLogger, FlushRunLoggers
+from Parallel import GetForkContext
 
 
 def DiagnosticsTotalTimeStats(path_to_log, obs_table, args):
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write(f"Total Livetime: {obs_table['LIVETIME'].sum()} s \n")
         f.write(f"Total Ontime: {obs_table['ONTIME'].sum()} s \n")
         f.write(
@@ -14,7 +17,7 @@ def DiagnosticsTotalTimeStats(path_to_log, obs_table, args):
 
 
 def DiagnosticsDeadtimeDistribution(path_to_log, obs_table, args):
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("Making Deadtime distribution plot:\n")
         plt.hist(1 - obs_table["DEADC"])
         plt.xlabel("Deadtime")
@@ -39,7 +42,7 @@ def DiagnosticsDeadtimeDistribution(path_to_log, obs_table, args):
 
 
 def DiagnosticsPointingOffsetDistribution(path_to_log, obs_table, args):
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("Making Pointing Offset distribution plot:\n")
 
         plt.hist(
@@ -100,11 +103,126 @@ def DiagnosticsPointingOffsetDistribution(path_to_log, obs_table, args):
     return
 
 
-def DiagnosticsPeekAtIRFs(path_to_log, observations, args):
+class DiagnosticsRenderer:
+    """
+    Background processes (Agg backend) for the IRF and event peek plots, so
+    the pipeline does not wait for them. The plots are queued with submit,
+    rendered by n_jobs forked processes after start, and wait collects the
+    results.
+
+    The processes are forked once, with all the plots already queued, and
+    report back through a queue that this process only reads from: no thread
+    is left running here while the reduction forks its own pools.
+    """
+
+    def __init__(self, observations, n_jobs):
+        self.observations = observations
+        self.n_jobs = n_jobs
+        self.jobs = []
+        self.processes = []
+        self.results = None
+
+    def submit(self, kind, index, filepath):
+        self.jobs.append((kind, index, filepath))
+
+    def start(self):
+        context = GetForkContext()
+        self.results = context.Queue()
+        # Workers write straight to the log files, so write out what is buffered first
+        FlushRunLoggers()
+        for i in range(min(self.n_jobs, len(self.jobs))):
+            process = context.Process(
+                target=_RenderPeekPlots,
+                args=(self.observations, self.jobs[i :: self.n_jobs], self.results),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    def running(self):
+        """
+        Number of renderer processes still running.
+        """
+        return sum(process.is_alive() for process in self.processes)
+
+    def wait(self, poll_seconds=1.0):
+        """
+        Returns {filepath: error message or None} of all the submitted plots.
+        Plots of a renderer process that died (e.g. killed for using too much
+        memory) are returned with an error instead of being waited for.
+        """
+        errors = {}
+        while len(errors) < len(self.jobs):
+            try:
+                filepath, error = self.results.get(timeout=poll_seconds)
+                errors[filepath] = error
+                continue
+            except queue.Empty:
+                pass
+            if self.running() == 0:
+                # Collect what the processes sent before they exited
+                try:
+                    while len(errors) < len(self.jobs):
+                        filepath, error = self.results.get(timeout=poll_seconds)
+                        errors[filepath] = error
+                except queue.Empty:
+                    pass
+                break
+        for i, process in enumerate(self.processes):
+            process.join()
+            for _, _, filepath in self.jobs[i :: self.n_jobs]:
+                if filepath not in errors:
+                    errors[filepath] = (
+                        f"renderer process exited with code {process.exitcode}"
+                    )
+        return errors
+
+
+def _RenderPeekPlots(observations, jobs, results):
+    # Runs in a DiagnosticsRenderer process
+    import matplotlib
+
+    matplotlib.use("Agg")
+    for kind, index, filepath in jobs:
+        try:
+            PeekAtObservation(observations[index], kind, filepath)
+            results.put((filepath, None))
+        except Exception as e:
+            results.put((filepath, str(e)))
+
+
+def StartDiagnosticsRenderer(observations, args):
+    """
+    DiagnosticsRenderer for DiagnosticsPeekAtIRFs and DiagnosticsPeekAtEvents
+    (call its start() after them and WaitForDiagnosticsRenderer before exiting).
+    It uses a quarter (at least one) of the -NJobs processes while it runs,
+    see ReductionJobs. With -NJobs 1 returns None: the plots are then made
+    in-line.
+    """
+    if args.NJobs <= 1:
+        return None
+    return DiagnosticsRenderer(observations, max(args.NJobs // 4, 1))
+
+
+def ReductionJobs(renderer, args):
+    """
+    Number of processes for a pool started now: -NJobs less the renderer
+    processes that are still running, so that together they stay within -NJobs.
+    """
+    if renderer is None:
+        return args.NJobs
+    return max(args.NJobs - renderer.running(), 1)
+
+
+def DiagnosticsPeekAtIRFs(path_to_log, observations, args, renderer=None):
+    """
+    If renderer (see StartDiagnosticsRenderer) is given the plots are only
+    queued on it, to be made in the background.
+    """
     irf_dir = os.path.join(args.ADir, "Diagnostics", "IRF_Plots")
     os.makedirs(irf_dir, exist_ok=True)
     # Generate and save IRF plots
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write(
             "Peek at IRFs for first 10 observations (or all observations if less than 10):\n"
         )
@@ -112,21 +230,27 @@ def DiagnosticsPeekAtIRFs(path_to_log, observations, args):
             if (
                 i < 10 or args.Debug
             ):  # Limit to 10 datasets for plotting to save time unless Debug is set to True
-                obs.peek(figsize=(25, 5))
-                fig = plt.gcf()  # Get the current figure
                 obs_id = obs.obs_id
                 filename = f"irf_obs_{obs_id}.png"
                 filepath = os.path.join(irf_dir, filename)
-                fig.savefig(filepath, bbox_inches="tight")
+                if renderer is not None:
+                    renderer.submit("irf", i, filepath)
+                    f.write(f"Saving IRF figure for Obs ID {obs_id} to {filepath}\n")
+                    continue
+                PeekAtObservation(obs, "irf", filepath)
                 f.write(f"Saved IRF figure for Obs ID {obs_id} to {filepath}\n")
-                plt.close(fig)
+    return
 
 
-def DiagnosticsPeekAtEvents(path_to_log, observations, args):
+def DiagnosticsPeekAtEvents(path_to_log, observations, args, renderer=None):
+    """
+    If renderer (see StartDiagnosticsRenderer) is given the plots are only
+    queued on it, to be made in the background.
+    """
     event_dir = os.path.join(args.ADir, "Diagnostics/Event_Plots")
     os.makedirs(event_dir, exist_ok=True)
     # Generate and save event plots
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("--------------------------------------------------\n")
         f.write(
             "Peek at Events for first 10 observations (or all observations if less than 10):\n"
@@ -135,47 +259,98 @@ def DiagnosticsPeekAtEvents(path_to_log, observations, args):
             if (
                 i < 10 or args.Debug
             ):  # Limit to 10 datasets for plotting to save time unless Debug is set to True
-                obs.events.peek()
-                fig = plt.gcf()  # Get the current figure
                 obs_id = obs.obs_id
                 filename = f"event_obs_{obs_id}.png"
                 filepath = os.path.join(event_dir, filename)
-                fig.savefig(filepath, bbox_inches="tight")
+                if renderer is not None:
+                    renderer.submit("events", i, filepath)
+                    f.write(f"Saving Event figure for Obs ID {obs_id} to {filepath}\n")
+                    continue
+                PeekAtObservation(obs, "events", filepath)
                 f.write(f"Saved Event figure for Obs ID {obs_id} to {filepath}\n")
-                plt.close(fig)
-                i += 1
     return
 
 
-def check_livetimes(obs_table, all_datasets, observations, path_to_log):
-    obs_table_livetime_sum = 0
-    info_table_livetime_sum = 0
-    with open(path_to_log, "a") as f:
+def PeekAtObservation(obs, kind, filepath):
+    if kind == "irf":
+        obs.peek(figsize=(25, 5))
+    else:
+        obs.events.peek()
+    fig = plt.gcf()  # Get the current figure
+    fig.savefig(filepath, bbox_inches="tight")
+    plt.close(fig)
+
+
+def WaitForDiagnosticsRenderer(renderer, path_to_log):
+    """
+    Wait for the background plots and log any that failed.
+    """
+    if renderer is None:
+        return
+    errors = renderer.wait()
+    failed = 0
+    with GetRunLogger(path_to_log) as f:
+        for filepath, error in errors.items():
+            if error is not None:
+                failed += 1
+                print(f"WARNING! Could not make diagnostic plot {filepath}: {error}")
+                f.write(
+                    f"WARNING! Could not make diagnostic plot {filepath}: {error}\n"
+                )
+        f.write(
+            f"Background diagnostic plots complete: {len(errors) - failed} of {len(errors)} saved\n"
+        )
+
+
+def check_livetimes(obs_table, run_stats, observations, path_to_log, args):
+    """
+    Compare the livetime of each run in obs_table with its reduced dataset
+    (run_stats is the per-run table from DatasetStats.GetRunStats).
+    Runs whose ratio is outside 0.99-1.01 are warned about, and the per-run
+    comparison is written to Diagnostics/LivetimeCheck.ecsv.
+    """
+    with GetRunLogger(path_to_log) as f:
         f.write("--------------------------------------------------\n")
         f.write("Diagnostics: Check Livetime matches in obs_table and info_table\n")
-    for i in range(len(observations)):
-        obs_table_livetime = obs_table["LIVETIME"][i]
-        obs_table_livetime_sum += obs_table_livetime
-        info_table_livetime = all_datasets.info_table(cumulative=False)["livetime"][i]
-        info_table_livetime_sum += info_table_livetime
-        if (
-            obs_table_livetime / info_table_livetime < 0.99
-            or obs_table_livetime / info_table_livetime > 1.01
-        ):
-            print(
-                f"WARNING!: Run: {observations[i].obs_id}: obs_table livetime: {obs_table_livetime} info_table livetime: {info_table_livetime}"
-            )
-            print(
-                f"WARNING! obs_table livetime / info_table livetime: {obs_table_livetime/info_table_livetime:.2f}"
+    info_table = run_stats
+    # Datasets are named by obs id, match the rows on that rather than on position
+    obs_ids = np.array([obs.obs_id for obs in observations])
+    obs_table_index = dict(zip(np.asarray(obs_table["OBS_ID"]), range(len(obs_table))))
+    obs_table_livetime = np.asarray(
+        obs_table["LIVETIME"][[obs_table_index[obs_id] for obs_id in obs_ids]],
+        dtype=float,
+    )
+    info_table_index = dict(zip(info_table["name"], range(len(info_table))))
+    info_table_livetime = u.Quantity(info_table["livetime"]).to_value("s")[
+        [info_table_index[str(obs_id)] for obs_id in obs_ids]
+    ]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = obs_table_livetime / info_table_livetime
+    mismatch = ~((ratio >= 0.99) & (ratio <= 1.01))
+
+    livetime_check = Table(
+        {
+            "OBS_ID": obs_ids,
+            "LIVETIME_OBS_TABLE": obs_table_livetime * u.s,
+            "LIVETIME_INFO_TABLE": info_table_livetime * u.s,
+            "RATIO": ratio,
+            "MISMATCH": mismatch,
+        }
+    )
+    livetime_check.write(
+        os.path.join(args.ADir, "Diagnostics/LivetimeCheck.ecsv"), overwrite=True
+    )
+
+    with GetRunLogger(path_to_log) as f:
+        for row in livetime_check[mismatch]:
+            warning = (
+                f"WARNING!: Run: {row['OBS_ID']}: obs_table livetime: {row['LIVETIME_OBS_TABLE']} info_table livetime: {row['LIVETIME_INFO_TABLE']}\n"
+                f"WARNING! obs_table livetime / info_table livetime: {row['RATIO']:.2f}\n"
             )
-            with open(path_to_log, "a") as f:
-                f.write(
-                    f"WARNING!: Run: {observations[i].obs_id}: obs_table livetime: {obs_table_livetime} info_table livetime: {info_table_livetime}\n"
-                )
-                f.write(
-                    f"WARNING! obs_table livetime / info_table livetime: {obs_table_livetime/info_table_livetime:.2f}\n"
-                )
-    with open(path_to_log, "a") as f:
+            print(warning, end="")
+            f.write(warning)
+        obs_table_livetime_sum = obs_table_livetime.sum()
+        info_table_livetime_sum = info_table_livetime.sum()
         f.write("--------------------------------------------------\n")
         f.write(f"Total Livetime from obs_table: {obs_table_livetime_sum}\n")
         f.write(f"Total Livetime from info_table: {info_table_livetime_sum}\n")
@@ -186,9 +361,13 @@ def check_livetimes(obs_table, all_datasets, observations, path_to_log):
             f.write(
                 "WARNING! Total livetime from obs_table and info_table do not match!\n"
             )
+        f.write(
+            f"Per-run livetime comparison ({mismatch.sum()} mismatched runs) saved to {args.ADir}/Diagnostics/LivetimeCheck.ecsv\n"
+        )
 
 
 def SaveInfoTable(datasets, args):
+    # Built after the fit so that npred and stat_sum include the fitted model
     info_table = datasets.info_table(cumulative=False)
     info_table.write(
         os.path.join(args.ADir, "Diagnostics/InfoTable.ecsv"), overwrite=True
@@ -211,7 +390,7 @@ def PlotOnOffEvents(info_table_not_cumulative, args, path_to_log):
     axes[0].legend()
     plt.tight_layout()
     plt.savefig(os.path.join(args.ADir, "Diagnostics/OnOffCounts.pdf"))
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("Saved On/Off Counts figure to Diagnostics/OnOffCounts.pdf\n")
     plt.close(fig)
 
@@ -221,7 +400,7 @@ def PlotOnOffEvents(info_table_not_cumulative, args, path_to_log):
     plt.ylabel("Off Counts")
     plt.title("On/Off Counts Scatter Plot")
     plt.savefig(os.path.join(args.ADir, "Diagnostics/OnOffCounts_Scatter.pdf"))
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write(
             "Saved On/Off Counts Scatter figure to Diagnostics/OnOffCounts_Scatter.pdf\n"
         )
@@ -1,4 +1,5 @@
 from importer import *
+from RunLogger import GetRunLogger
 
 
 def EnergyAxes(args, path_to_log):
@@ -16,7 +17,7 @@ def EnergyAxes(args, path_to_log):
         unit="TeV",
         name="energy_true",
     )
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("--------------------------------------------------\n")
         f.write("Energy Axis: " + str(energy_axis) + "\n")
         f.write("True Energy Axis: " + str(energy_axis_true) + "\n")
@@ -1,11 +1,11 @@
 from importer import *
-
-from astropy.io import fits
-import astropy.units as u
-from regions import CircleSkyRegion
-from gammapy.maps import RegionGeom
-from astropy.coordinates import SkyCoord
-from astropy.table import Table
+from RunLogger import GetRunLogger
+from Cache import GetCacheDir, HashItems, HashFiles, ReadJSON, WriteJSON
+from BrightStars import (
+    ConeSearchBrightStars,
+    QueryBrightStars,
+    ReadBrightStarCatalog,
+)
 
 
 def GetOnRegionRadius(args, path_to_log):
@@ -20,13 +20,13 @@ def GetOnRegionRadius(args, path_to_log):
         with fits.open(first_file) as hdul:
             if "EFFECTIVE AREA" in hdul and "RAD_MAX" in hdul["EFFECTIVE AREA"].header:
                 radius = hdul["EFFECTIVE AREA"].header["RAD_MAX"] * u.deg
-                with open(path_to_log, "a") as f:
+                with GetRunLogger(path_to_log) as f:
                     f.write(
                         f"Using IRF-defined RAD_MAX = {radius.value} deg for On Region\n"
                     )
     except Exception as irf_error:
         print(f"[WARNING] Could not read RAD_MAX from IRF: {irf_error}")
-        with open(path_to_log, "a") as f:
+        with GetRunLogger(path_to_log) as f:
             f.write(f"WARNING: Could not read RAD_MAX from IRF: {irf_error}\n")
 
     if args.OnRegionRadius is not None:
@@ -43,76 +43,153 @@ def GetOnRegion(target_position, args, energy_axis, path_to_log, on_region_radiu
     # Build region
     on_region = CircleSkyRegion(center=target_position, radius=on_region_radius)
     # Log
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write(f"On Region: {on_region}\n")
     geom = RegionGeom.create(region=on_region, axes=[energy_axis])
     return on_region, geom
 
 
+def GetGeometryAndExclusionMask(
+    target_position, args, energy_axis, path_to_log, on_region_radius
+):
+    """
+    On region, its RegionGeom, the exclusion regions and the exclusion mask.
+    These only depend on the target position, on region radius, energy axis and
+    the exclusion lists, so they are kept in <CacheDir>/Geometry (mask FITS plus
+    a JSON descriptor) and read back when those inputs match.
+    """
+    cache_dir = GetCacheDir(args, "Geometry")
+    if cache_dir is None:
+        on_region, geom = GetOnRegion(
+            target_position, args, energy_axis, path_to_log, on_region_radius
+        )
+        exclusion_regions = GetExclusionRegions(target_position, args, path_to_log)
+        exclusion_mask = GetExclusionMask(
+            exclusion_regions, target_position, energy_axis
+        )
+        return on_region, geom, exclusion_regions, exclusion_mask
+
+    exclusion_files = [
+        path for path in [args.BrightStarCatalog, args.exclusion_csv] if path
+    ]
+    key = HashItems(
+        target_position.ra.deg,
+        target_position.dec.deg,
+        on_region_radius.to_value("deg"),
+        energy_axis.edges.to_value("TeV"),
+        args.ObjectName,
+        args.BrightStarCatalog is None,  # Vizier or the local catalog
+        args.exclusion_csv is None,
+        HashFiles(exclusion_files, cache_dir=cache_dir),
+    )
+    descriptor_path = os.path.join(cache_dir, f"{key}.json")
+    mask_path = os.path.join(cache_dir, f"{key}_mask.fits")
+    descriptor = ReadJSON(descriptor_path)
+    if descriptor is not None and os.path.exists(mask_path):
+        on_region = CircleSkyRegion(
+            center=SkyCoord(
+                descriptor["on_region"]["ra"],
+                descriptor["on_region"]["dec"],
+                unit="deg",
+                frame="icrs",
+            ),
+            radius=descriptor["on_region"]["radius"] * u.deg,
+        )
+        geom = RegionGeom.create(region=on_region, axes=[energy_axis])
+        exclusion_regions = Table(descriptor["exclusion_regions"])
+        exclusion_mask = Map.read(mask_path)
+        exclusion_mask.data = exclusion_mask.data.astype(bool)
+        with GetRunLogger(path_to_log) as f:
+            f.write(f"On Region: {on_region}\n")
+            f.write(
+                f"Geometry and exclusion mask ({len(exclusion_regions)} exclusion regions) read from cache {descriptor_path}\n"
+            )
+        return on_region, geom, exclusion_regions, exclusion_mask
+
+    on_region, geom = GetOnRegion(
+        target_position, args, energy_axis, path_to_log, on_region_radius
+    )
+    exclusion_regions = GetExclusionRegions(target_position, args, path_to_log)
+    exclusion_mask = GetExclusionMask(exclusion_regions, target_position, energy_axis)
+    # Mask first, so that a descriptor is only ever found next to a complete mask
+    exclusion_mask.write(
+        f"{mask_path}.{os.getpid()}.tmp", format="gadf", overwrite=True
+    )
+    os.replace(f"{mask_path}.{os.getpid()}.tmp", mask_path)
+    WriteJSON(
+        descriptor_path,
+        {
+            "object_name": args.ObjectName,
+            "on_region": {
+                "ra": on_region.center.icrs.ra.deg,
+                "dec": on_region.center.icrs.dec.deg,
+                "radius": on_region.radius.to_value("deg"),
+            },
+            "energy_edges_TeV": energy_axis.edges.to_value("TeV").tolist(),
+            "bright_star_catalog": args.BrightStarCatalog,
+            "exclusion_csv": args.exclusion_csv,
+            "exclusion_regions": {
+                name: exclusion_regions[name].tolist()
+                for name in exclusion_regions.colnames
+            },
+        },
+    )
+    return on_region, geom, exclusion_regions, exclusion_mask
+
+
 def GetExclusionRegions(target_position, args, path_to_log):
-    vizier = Vizier(catalog="Tycho2")
-    vizier.ROW_LIMIT = 100000
-    vizier.COL_LIMIT = -1
-    result = vizier.query_region(args.ObjectName, radius=4 * u.deg)
-    with open(path_to_log, "a") as f:
+    if args.BrightStarCatalog is not None:
+        # Offline: cone search in the local bright star catalog (see BrightStars.py)
+        StarTable = ConeSearchBrightStars(
+            ReadBrightStarCatalog(args.BrightStarCatalog),
+            target_position,
+            radius=4 * u.deg,
+            mag_limit=6,
+        )
+        catalog = f"local Tycho2 bright star catalog {args.BrightStarCatalog}"
+    else:
+        StarTable = QueryBrightStars(target_position, radius=4 * u.deg, mag_limit=6)
+        catalog = "Tycho2 catalog"
+    with GetRunLogger(path_to_log) as f:
         f.write("Stars to be excluded based on VEGAS' definition of a bright star:\n")
-        f.write(" - Using Tycho2 catalog\n")
+        f.write(f" - Using {catalog}\n")
         f.write(" - Bright stars are defined as those with BTmag < 6\n")
         f.write(" - Stars are excluded if they are within 4 degrees of the target\n")
         f.write(" - A 0.1 degree exclusion region is used for the stars\n")
         f.write(" - A 0.3 degree exclusion region is used for the target\n")
         f.write("\n Bright Stars That Are Excluded: \n")
-        StarTable = Table(
-            names=("RA(ICRS)", "DE(ICRS)", "BTmag", "TYC1", "TYC2", "TYC3", "HIP")
-        )
-        for row in result[0][
-            ["RA(ICRS)", "DE(ICRS)", "BTmag", "TYC1", "TYC2", "TYC3", "HIP"]
-        ]:
-            if row["BTmag"] < 6:
-                StarTable.add_row(row)
-                f.write(str(row) + "\n")
+        for row in StarTable:
+            f.write(str(row) + "\n")
         f.write("--------------------------------------------------\n")
 
-    # exclusion region at source
-    exclusion_regions = []
-    exclusion_regions.append(
-        CircleSkyRegion(
-            center=SkyCoord(
-                target_position.ra, target_position.dec, unit="deg", frame="icrs"
-            ),
-            radius=0.3 * u.deg,
-        )
+    # exclusion region at source, then the bright stars
+    exclusion_regions = Table(
+        {
+            "ra": np.r_[target_position.ra.deg, np.asarray(StarTable["RA(ICRS)"])],
+            "dec": np.r_[target_position.dec.deg, np.asarray(StarTable["DE(ICRS)"])],
+            "radius": np.r_[0.3, np.full(len(StarTable), 0.1)],
+            "name": np.r_[[str(args.ObjectName)], np.full(len(StarTable), "")],
+        }
     )
 
-    # exclusion regions for bright stars
-    for Star in StarTable:
-        target_position_star = SkyCoord(
-            Star["RA(ICRS)"], Star["DE(ICRS)"], unit="deg"
-        ).icrs
-        exclusion_regions.append(
-            CircleSkyRegion(
-                center=SkyCoord(
-                    target_position_star.ra,
-                    target_position_star.dec,
-                    unit="deg",
-                    frame="icrs",
-                ),
-                radius=0.1 * u.deg,
-            )
-        )
-
     # User supplies exclusion regions.
     if args.exclusion_csv is not None:
-        user_regions, _ = read_exclusion_csv(args.exclusion_csv)
-        exclusion_regions.extend(user_regions)
+        user_regions = read_exclusion_csv(args.exclusion_csv)
+        exclusion_regions = vstack([exclusion_regions, user_regions])
 
-        with open(path_to_log, "a") as f:
+        with GetRunLogger(path_to_log) as f:
             f.write(f"Added {len(user_regions)} user-defined exclusion regions\n")
 
     return exclusion_regions
 
 
 def GetExclusionMask(exclusion_regions, target_position, energy_axis):
+    """
+    Boolean mask, False within any of the exclusion_regions (Table with ra, dec, radius in deg).
+    Pixels are tested by the angular separation of their centres from the region centres.
+    A k-d tree of the pixel centres is searched once per region, so the cost scales
+    with the number of pixels rather than pixels x regions.
+    """
     exclusion_mask_geom = WcsGeom.create(
         binsz=0.01,  # in degrees
         width=(6, 6),
@@ -121,18 +198,36 @@ def GetExclusionMask(exclusion_regions, target_position, energy_axis):
         frame="icrs",
         axes=[energy_axis],
     )
-    exclusion_mask = (
-        ~exclusion_mask_geom.to_image()
-        .to_cube([energy_axis.squash()])
-        .region_mask(exclusion_regions)
+    image_geom = exclusion_mask_geom.to_image()
+    coords = image_geom.get_coord(frame="icrs")
+    pixel_vectors = UnitVectors(coords.lon.to_value("deg"), coords.lat.to_value("deg"))
+    tree = cKDTree(pixel_vectors.reshape(-1, 3))
+    # Chord length between unit vectors separated by the region radius
+    chords = 2 * np.sin(np.radians(np.asarray(exclusion_regions["radius"])) / 2)
+    inside = tree.query_ball_point(
+        UnitVectors(exclusion_regions["ra"], exclusion_regions["dec"]), chords
+    )
+    mask = np.ones(image_geom.data_shape, dtype=bool)
+    inside = [np.asarray(pixels, dtype=int) for pixels in inside]
+    mask.flat[np.concatenate(inside + [np.zeros(0, dtype=int)])] = False
+    exclusion_mask = Map.from_geom(
+        image_geom.to_cube([energy_axis.squash()]), data=mask[np.newaxis], dtype=bool
     )
     return exclusion_mask
 
 
+def UnitVectors(ra, dec):
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    return np.stack(
+        [np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1
+    )
+
+
 def read_exclusion_csv(csv_path):
     """
     Read csv of exclusion regions.
-    Return list of CircleSkyRegion objects.
+    Return Table with columns ra, dec, radius (all deg) and name.
 
     Expected columns:
       - ra  (deg, ICRS)
@@ -145,26 +240,31 @@ def read_exclusion_csv(csv_path):
         format="csv",
         names=("ra", "dec", "radius", "name"),
     )
-    regions = []
-
-    for row in table:
-        # get RA and DEC
-        coord = SkyCoord(
-            ra=row["ra"] * u.deg,
-            dec=row["dec"] * u.deg,
-            frame="icrs",
-        )
-
-        # get radius
-        radius_val = row["radius"]
-
-        if isinstance(radius_val, str):
-            # e.g. "5 arcmin"
-            radius = u.Quantity(radius_val)
-        else:
-            # e.g. 0.2 → assume degrees
-            radius = radius_val * u.deg
-
-        regions.append(CircleSkyRegion(center=coord, radius=radius))
-
-    return regions, table
+    radius = table["radius"]
+    if radius.dtype.kind in "iuf":
+        # e.g. 0.2 → assume degrees
+        radius_deg = np.asarray(radius, dtype=float)
+    else:
+        # e.g. "5 arcmin", only parse each distinct string once
+        values, inverse = np.unique(np.asarray(radius, dtype=str), return_inverse=True)
+        parsed = [u.Quantity(value) for value in values]
+        parsed = [
+            (
+                value.value
+                if value.unit == u.dimensionless_unscaled
+                else value.to_value("deg")
+            )
+            for value in parsed
+        ]
+        radius_deg = np.asarray(parsed)[inverse]
+    # An all empty name column is read as masked int, so convert before filling
+    name = table["name"]
+    name = np.where(np.ma.getmaskarray(name), "", np.asarray(name).astype(str))
+    return Table(
+        {
+            "ra": np.asarray(table["ra"], dtype=float),
+            "dec": np.asarray(table["dec"], dtype=float),
+            "radius": radius_deg,
+            "name": np.asarray(name, dtype=str),
+        }
+    )
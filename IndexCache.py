@@ -0,0 +1,200 @@
+from importer import *
+import json
+from RunLogger import GetRunLogger
+from Cache import GetCacheDir, HashItems
+from GetGeometry import UnitVectors
+from BuildIndex import BuildIndex
+
+OBS_INDEX_CACHE_FILE = "obs-index.cache.npz"
+
+
+def GetObsIndexCache(data_store, args, path_to_log):
+    """
+    Pre-parsed columns of the obs index used by SelectRuns, in the row order of
+    data_store.obs_table (sorted by OBS_ID):
+      OBS_ID, MJD (from DATE-OBS), PNT_XYZ (pointing unit vectors),
+      OBJECT_CODE (index into OBJECT_NAMES) and OBJECT_NAMES.
+    Stored as obs-index.cache.npz next to obs-index.fits(.gz), or in
+    <CacheDir>/ObsIndex if the DL3 directory is not writable, and rebuilt when
+    the obs index file changes (size or mtime).
+    """
+    obs_index_path = GetIndexFilePath(args.DL3Path, data_store.DEFAULT_OBS_TABLE)
+    stat = os.stat(obs_index_path)
+    stamp = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    obs_ids = np.asarray(data_store.obs_table["OBS_ID"], dtype=np.int64)
+
+    cache_paths = [os.path.join(os.path.dirname(obs_index_path), OBS_INDEX_CACHE_FILE)]
+    cache_dir = GetCacheDir(args, "ObsIndex")
+    if cache_dir is not None:
+        cache_paths.append(
+            os.path.join(cache_dir, f"{HashItems(os.path.abspath(obs_index_path))}.npz")
+        )
+    for cache_path in cache_paths:
+        try:
+            with np.load(cache_path) as cached:
+                index = {name: cached[name] for name in cached.files}
+        except (OSError, ValueError):
+            continue
+        if np.array_equal(index["STAMP"], stamp) and np.array_equal(
+            index["OBS_ID"], obs_ids
+        ):
+            with GetRunLogger(path_to_log) as f:
+                f.write(f"Obs index read from cache {cache_path}\n")
+            return index
+
+    obs_table = data_store.obs_table
+    object_names, object_code = np.unique(
+        np.asarray(obs_table["OBJECT"], dtype=str), return_inverse=True
+    )
+    index = {
+        "STAMP": stamp,
+        "OBS_ID": obs_ids,
+        "MJD": Time(obs_table["DATE-OBS"]).mjd,
+        "PNT_XYZ": UnitVectors(obs_table["RA_PNT"], obs_table["DEC_PNT"]),
+        "OBJECT_CODE": object_code.astype(np.int32),
+        "OBJECT_NAMES": object_names,
+    }
+    for cache_path in cache_paths:
+        # Write then rename so that a reader never sees a partly written file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        try:
+            np.savez(tmp_path, **index)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            continue
+        with GetRunLogger(path_to_log) as f:
+            f.write(f"Obs index cache written to {cache_path}\n")
+        break
+    return index
+
+
+def GetIndexFilePath(base_dir, default_filename):
+    """
+    Path of an index file in base_dir, accepting it with or without ".gz".
+    """
+    path = os.path.join(base_dir, default_filename)
+    if not os.path.exists(path) and path.endswith(".gz"):
+        path = path[: -len(".gz")]
+    return path
+
+
+def GetDataStore(args, path_to_log):
+    """
+    DataStore.from_dir(args.DL3Path), but the parsed HDU and obs index tables are
+    kept as a column snapshot (.npz, see WriteTablesSnapshot) in
+    <CacheDir>/DataStore and reused while both index files are unchanged (size
+    and mtime), so the compressed FITS index files in the DL3 directory are not
+    re-read and re-parsed on every invocation.
+    If the directory has no HDU index (e.g. a fresh DL3 delivery) it is built
+    first with BuildIndex.
+    """
+    if not os.path.exists(GetIndexFilePath(args.DL3Path, DataStore.DEFAULT_HDU_TABLE)):
+        with GetRunLogger(path_to_log) as f:
+            f.write(f"No HDU index found in {args.DL3Path}, building one\n")
+        BuildIndex(args.DL3Path, n_jobs=max(args.NJobs, 1), path_to_log=path_to_log)
+    paths = [
+        GetIndexFilePath(args.DL3Path, DataStore.DEFAULT_HDU_TABLE),
+        GetIndexFilePath(args.DL3Path, DataStore.DEFAULT_OBS_TABLE),
+    ]
+    stamps = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stamps.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+        else:
+            stamps.append([os.path.abspath(path), -1, -1])
+    cache_dir = GetCacheDir(args, "DataStore")
+    if cache_dir is None:
+        return DataStore.from_dir(args.DL3Path)
+    snapshot_path = os.path.join(
+        cache_dir, f"{HashItems(os.path.abspath(args.DL3Path))}.npz"
+    )
+    try:
+        tables, snapshot_stamps = ReadTablesSnapshot(snapshot_path)
+        if snapshot_stamps == stamps:
+            with GetRunLogger(path_to_log) as f:
+                f.write(f"HDU and obs index read from snapshot {snapshot_path}\n")
+            hdu_table = HDUIndexTable(tables["HDU_INDEX"], copy=False)
+            hdu_table.meta["BASE_DIR"] = str(make_path(args.DL3Path))
+            return DataStore(
+                hdu_table=hdu_table,
+                obs_table=ObservationTable(tables["OBS_INDEX"], copy=False),
+            )
+    except (OSError, ValueError, KeyError):
+        pass
+
+    data_store = DataStore.from_dir(args.DL3Path)
+    WriteTablesSnapshot(
+        snapshot_path,
+        {"HDU_INDEX": data_store.hdu_table, "OBS_INDEX": data_store.obs_table},
+        stamps,
+    )
+    return data_store
+
+
+def WriteTablesSnapshot(path, tables, stamps):
+    """
+    Writes tables ({name: Table}) to a compressed .npz, one array per column
+    (string columns as their distinct values plus a code per row, and one more
+    per mask of a masked column), with the column units, table meta and stamps
+    as JSON. Nothing is pickled, so
+    a snapshot in a shared cache directory cannot run code when it is read.
+    """
+    arrays = {}
+    layout = {"stamps": stamps, "tables": {}}
+    for name, table in tables.items():
+        layout["tables"][name] = {
+            "columns": table.colnames,
+            "units": {
+                column: str(table[column].unit)
+                for column in table.colnames
+                if table[column].unit is not None
+            },
+            "meta": dict(table.meta),
+        }
+        for i, column in enumerate(table.colnames):
+            values = np.asarray(table[column])
+            if values.dtype.kind in "SU" and values.ndim == 1:
+                # Index strings repeat a lot (HDU_TYPE, FILE_DIR, ...), so they are
+                # stored once each, with a code per row
+                values, codes = np.unique(values, return_inverse=True)
+                arrays[f"{name}_{i}_codes"] = codes.astype(np.int32)
+            arrays[f"{name}_{i}"] = values
+            mask = np.ma.getmaskarray(table[column])
+            if mask.any():
+                arrays[f"{name}_{i}_mask"] = mask
+    arrays["LAYOUT"] = np.array(json.dumps(layout, default=str))
+    # Write then rename so that a reader never sees a partly written file
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def ReadTablesSnapshot(path):
+    """
+    Returns ({name: Table}, stamps) as written by WriteTablesSnapshot.
+    """
+    with np.load(path, allow_pickle=False) as snapshot:
+        layout = json.loads(str(snapshot["LAYOUT"]))
+        tables = {}
+        for name, table_layout in layout["tables"].items():
+            columns = []
+            for i in range(len(table_layout["columns"])):
+                column = snapshot[f"{name}_{i}"]
+                if f"{name}_{i}_codes" in snapshot.files:
+                    column = column[snapshot[f"{name}_{i}_codes"]]
+                if f"{name}_{i}_mask" in snapshot.files:
+                    column = np.ma.MaskedArray(
+                        column, mask=snapshot[f"{name}_{i}_mask"]
+                    )
+                columns.append(column)
+            table = Table(
+                columns,
+                names=table_layout["columns"],
+                meta=table_layout["meta"],
+                copy=False,
+            )
+            for column, unit in table_layout["units"].items():
+                table[column].unit = unit
+            tables[name] = table
+    return tables, layout["stamps"]
@@ -1,18 +1,25 @@
 from importer import *
 
-"""
+
 def LMS(n_on, n_off, alpha):
-    #Calculate the Li & Ma significance https://www.mpe.mpg.de/~ste/data/aa0839.pdf (Eq4)
-    #If using gammapy this should give same result as stats.WStatCountsStatistic(n_on=n_on, n_off=n_off, alpha=alpha).sqrt_ts
-    S = np.sqrt(2) * (
-        (n_on * np.log(((1 + alpha) * n_on) / (alpha * (n_on + n_off))))
-        + n_off * np.log(((1 + alpha) * n_off) / (n_on + n_off))
-    ) ** (1 / 2)
-    return S
-"""
+    """
+    Calculate the Li & Ma significance https://www.mpe.mpg.de/~ste/data/aa0839.pdf (Eq17)
+    This gives the same result as gammapy's stats.WStatCountsStatistic(n_on=n_on, n_off=n_off, alpha=alpha).sqrt_ts
+    Works element-wise on arrays, is signed by the excess and is 0 (not nan) where n_on or n_off is 0.
+    """
+    n_on = np.asarray(n_on, dtype=float)
+    n_off = np.asarray(n_off, dtype=float)
+    alpha = np.asarray(alpha, dtype=float)
+    n_tot = n_on + n_off
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ts = 2 * (
+            xlogy(n_on, (1 + alpha) * n_on / (alpha * n_tot))
+            + xlogy(n_off, (1 + alpha) * n_off / n_tot)
+        )
+    ts = np.where(n_tot > 0, np.clip(ts, 0, None), 0)
+    return np.sign(n_on - alpha * n_off) * np.sqrt(ts)
 
 
-"""
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Calculate the Li & Ma significance.",
@@ -32,6 +39,5 @@ if __name__ == "__main__":
         required=True,
     )
     args = parser.parse_args()
-    result = li_ma_significance(args.n_on, args.n_off, args.alpha)
+    result = LMS(args.n_on, args.n_off, args.alpha)
     print(f"Li & Ma significance: {result:.2f}")
-"""
@@ -1,8 +1,9 @@
 from importer import *
+from RunLogger import GetRunLogger
 
 
 def MakeLightCurve(path_to_log, datasets, args):
-    f = open(path_to_log, "a")
+    f = GetRunLogger(path_to_log)
     f.write("--------------------------------------------------\n")
     f.write("Light Curve: \n")
     if args.LightCurveMinEnergy != None:
@@ -71,5 +72,4 @@ def MakeLightCurve(path_to_log, datasets, args):
         f"LC = Table.read({args.ADir}/LightCurve/LightCurve.ecsv, format='ascii.ecsv') \n"
     )
     f.write("--------------------------------------------------\n")
-    f.close()
     return lc
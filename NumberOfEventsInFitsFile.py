@@ -1,4 +1,11 @@
+#!/usr/bin/env python3
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from astropy.io import fits
+from astropy.table import Table
+from DL3Files import FindDL3Files
 
 
 def NumberOfEventsInAFitsFile(file):
@@ -17,8 +24,103 @@ def NumberOfEventsInAFitsFile(file):
     plt.xlabel("Number Of Events in DL3 File")
 
     Note this usage has a known issue of also looking at `hdu-index.fits` and `obs-index.fits`
+    (NumberOfEventsInFolder does not).
     """
     hdul = fits.open(file)
     NumberOfEvents = hdul[1].header["NAXIS2"]
     hdul.close()
     return NumberOfEvents
+
+
+def ReadEventsHeader(file):
+    """
+    (OBS_ID, number of events) from the EVENTS header of a DL3 file, or None if
+    the file has no EVENTS HDU. Only headers are read, not the event data.
+    """
+    with fits.open(file, lazy_load_hdus=True) as hdul:
+        for hdu in hdul:
+            header = hdu.header
+            if (
+                hdu.name == "EVENTS"
+                or str(header.get("HDUCLAS1", "")).strip().upper() == "EVENTS"
+            ):
+                return header.get("OBS_ID", -1), header["NAXIS2"]
+    return None
+
+
+def NumberOfEventsInFolder(folder_path, n_jobs=8):
+    """
+    Number of events in every DL3 file below folder_path, from the EVENTS headers only.
+    Files are read n_jobs at a time; FITS files without an EVENTS HDU (e.g. the
+    index files) are skipped.
+    Returns a Table with columns OBS_ID, EVENTS, FILE_SIZE (bytes) and FILE, sorted by OBS_ID.
+
+    Example usage:
+
+    table = NumberOfEventsInFolder("/Users/nickibond/Documents/M87/dl3/")
+    plt.hist(table["EVENTS"])
+    """
+    files = [os.path.join(folder_path, file) for file in FindDL3Files(folder_path)]
+    with ThreadPoolExecutor(max_workers=max(n_jobs, 1)) as pool:
+        headers = list(pool.map(ReadEventsHeader, files))
+    rows = []
+    for file, header in zip(files, headers):
+        if header is None:
+            continue
+        obs_id, n_events = header
+        rows.append(
+            (
+                obs_id,
+                n_events,
+                os.path.getsize(file),
+                os.path.relpath(file, folder_path),
+            )
+        )
+    table = Table(
+        rows=rows,
+        names=("OBS_ID", "EVENTS", "FILE_SIZE", "FILE"),
+        dtype=(np.int64, np.int64, np.int64, str),
+    )
+    table["FILE_SIZE"].unit = "byte"
+    table.sort("OBS_ID")
+    return table
+
+
+def PlotNumberOfEvents(table, filename):
+    """
+    Histogram of the number of events per DL3 file, saved to filename.
+    Uses a Figure directly, so the caller's pyplot backend is left alone.
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure()
+    ax = figure.subplots()
+    ax.hist(table["EVENTS"])
+    ax.set_xlabel("Number Of Events in DL3 File")
+    ax.set_ylabel("Number of Files")
+    figure.savefig(filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Count the events in every DL3 file in a folder (headers only)."
+    )
+    parser.add_argument("folder", help="Folder of DL3 files.")
+    parser.add_argument(
+        "-NJobs", help="Number of files read at a time.", type=int, default=8
+    )
+    parser.add_argument(
+        "-Output", help="Write the per-run table to this file (e.g. events.ecsv)."
+    )
+    parser.add_argument(
+        "-Histogram", help="Save a histogram of the number of events to this file."
+    )
+    args = parser.parse_args()
+
+    table = NumberOfEventsInFolder(args.folder, n_jobs=args.NJobs)
+    if args.Output:
+        table.write(args.Output, overwrite=True)
+    if args.Histogram:
+        PlotNumberOfEvents(table, args.Histogram)
+    table.pprint(max_lines=-1, max_width=-1)
+    print(f"{len(table)} DL3 files, {table['EVENTS'].sum()} events in total.")
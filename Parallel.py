@@ -0,0 +1,68 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from RunLogger import FlushRunLoggers
+
+_shared = {}
+
+
+def GetShared():
+    """
+    Large inputs handed to ParallelMap/GetProcessPool through `shared`.
+    Worker functions read them from here instead of having them pickled per task.
+    """
+    return _shared
+
+
+def _InitialiseWorker(shared):
+    import matplotlib
+
+    matplotlib.use("Agg")  # Workers only ever save figures
+    _shared.clear()
+    _shared.update(shared)
+
+
+def GetForkContext():
+    """
+    multiprocessing context that forks workers where possible, spawns otherwise.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+
+def GetProcessPool(n_jobs, shared=None):
+    """
+    Local process pool with `shared` available to the workers through GetShared().
+
+    Workers are forked where possible: DL3toDL5.py is a top-level script, so a
+    spawned worker would re-run it, and a forked worker inherits `shared`
+    (observations, makers, datasets) without pickling it.
+    """
+    # Workers write straight to the log files, so write out what is buffered first
+    FlushRunLoggers()
+    return ProcessPoolExecutor(
+        max_workers=n_jobs,
+        mp_context=GetForkContext(),
+        initializer=_InitialiseWorker,
+        initargs=(shared or {},),
+    )
+
+
+def ParallelMap(function, items, n_jobs=1, shared=None):
+    """
+    Returns [function(item) for item in items], in the order of items.
+    If n_jobs > 1 the calls are spread over a local process pool, otherwise
+    they are run in this process.
+    function must be defined at module level so it can be sent to the workers.
+    """
+    items = list(items)
+    if n_jobs is None or n_jobs <= 1 or len(items) <= 1:
+        previous = dict(_shared)
+        _shared.update(shared or {})
+        try:
+            return [function(item) for item in items]
+        finally:
+            _shared.clear()
+            _shared.update(previous)
+    with GetProcessPool(min(n_jobs, len(items)), shared=shared) as pool:
+        return list(pool.map(function, items))
@@ -60,6 +60,9 @@ help_dict = {
     "SmoothBrokenPowerLawBeta": "Beta parameter for SmoothBrokenPowerLaw.",
     "exclusion_csv": "Path to a CSV file containing user-defined exclusion regions. The CSV should have columns: ra (deg), dec (deg), radius (deg or with astropy unit), name (optional). No header is required.",
     "NameSourceInOnOffRegionPlot": "Do you want the ObjectName to be printed on the On, Off, Exclusion regions plot?",
+    "BrightStarCatalog": "Path to a local bright star catalog made with BrightStars.py. If given, the bright star exclusion regions are found offline instead of querying Vizier.",
+    "TargetPositionsCSV": "Path to a CSV file of target positions used instead of resolving ObjectName online. The CSV should have columns: name, ra (deg), dec (deg). No header is required.",
+    "NJobs": "Number of local processes used to reduce the runs in parallel. Default 1 (serial).",
 }
 
 
@@ -388,6 +391,9 @@ tk.Checkbutton(f, variable=NameSourceInOnOffRegionPlot_var).grid(
     row=12, column=1, sticky="w", pady=2
 )
 CreateToolTip(label, help_dict["NameSourceInOnOffRegionPlot"])
+add_entry(f, "Number of Processes", "NJobs", "1", row=13)
+add_entry(f, "Target Positions File", "TargetPositionsCSV", "", browse=True, row=14)
+add_entry(f, "Bright Star Catalog", "BrightStarCatalog", "", browse=True, row=15)
 # --- Energy Axis tab ---
 f = frames["Energy Axis"]
 add_entry(f, "Energy Axis Min (TeV)", "EnergyAxisMin", "0.1", row=0)
@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import multiprocessing.util
+from datetime import datetime
+
+# Loggers of this process, keyed by the absolute path of the text log
+_loggers = {}
+
+
+class RunLogger:
+    """
+    Buffered writer for a text log (e.g. log.txt), used in place of
+    `open(path_to_log, "a")`:
+
+        with GetRunLogger(path_to_log) as f:
+            f.write("...")
+
+    Text is kept in memory and written out in blocks (and at every StageComplete
+    and at exit), instead of opening and closing the log for every message.
+    Next to the text log a JSON-lines event stream (log.jsonl) gets one record
+    per StageComplete with the wall time, CPU time and peak RSS.
+
+    A logger inherited by a forked worker process writes straight to the file,
+    so that the buffer inherited from the parent is never written twice.
+    A logger made in the worker itself buffers like any other and is written
+    out by CloseRunLogger, or when the worker exits.
+    """
+
+    def __init__(self, path_to_log, mode="a", start_time=None, buffer_size=64 * 1024):
+        self.path = path_to_log
+        self.events_path = os.path.splitext(path_to_log)[0] + ".jsonl"
+        self.pid = os.getpid()
+        self.buffer_size = buffer_size
+        self.start_time = time.time() if start_time is None else start_time
+        self._text = []
+        self._events = []
+        self._buffered = 0
+        # Start of the current stage. CPU time counts from the start of the process.
+        self._stage_wall = self.start_time
+        self._stage_cpu = 0.0
+        self._stage_cpu_children = 0.0
+        if mode == "w":
+            open(self.path, "w").close()
+            # The event stream is only created once there is an event
+            if os.path.exists(self.events_path):
+                os.remove(self.events_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _WriteThrough(self):
+        return os.getpid() != self.pid
+
+    def write(self, text):
+        if self._WriteThrough():
+            with open(self.path, "a") as f:
+                f.write(text)
+            return
+        self._text.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def Event(self, event, **fields):
+        """
+        Adds a record {"event": event, "time": ..., "pid": ..., **fields} to the event stream.
+        """
+        record = {
+            "event": event,
+            "time": datetime.now().isoformat(),
+            "pid": os.getpid(),
+            **fields,
+        }
+        line = json.dumps(record, default=str) + "\n"
+        if self._WriteThrough():
+            with open(self.events_path, "a") as f:
+                f.write(line)
+            return
+        self._events.append(line)
+
+    def StageComplete(self, stage):
+        """
+        Ends the current stage (which started at the previous StageComplete, or
+        at start_time): writes "<stage> Complete Time stamp: <minutes since start>"
+        to the text log, a "stage" record with wall time, CPU time and peak RSS
+        so far to the event stream, and flushes both.
+        cpu_children_s is the CPU time of the child processes reaped during the
+        stage only: the workers of a process pool are booked in full to the
+        stage in which the pool is shut down, whenever they did their work.
+        """
+        now = time.time()
+        cpu = time.process_time()
+        times = os.times()
+        cpu_children = times.children_user + times.children_system
+        self.write(
+            f"{stage} Complete Time stamp: {((now - self.start_time) / 60):.2f} minutes \n"
+        )
+        self.Event(
+            "stage",
+            stage=stage,
+            wall_s=round(now - self._stage_wall, 3),
+            cpu_s=round(cpu - self._stage_cpu, 3),
+            cpu_children_s=round(cpu_children - self._stage_cpu_children, 3),
+            elapsed_s=round(now - self.start_time, 3),
+            **PeakRSS(),
+        )
+        self._stage_wall = now
+        self._stage_cpu = cpu
+        self._stage_cpu_children = cpu_children
+        self.flush()
+
+    def RunTime(self):
+        return time.time() - self.start_time
+
+    def flush(self):
+        if self._WriteThrough():
+            return
+        for path, lines in [(self.path, self._text), (self.events_path, self._events)]:
+            if lines:
+                with open(path, "a") as f:
+                    f.write("".join(lines))
+                lines.clear()
+        self._buffered = 0
+
+
+def PeakRSS():
+    """
+    Peak resident set size [MB] so far of this process and of its finished children.
+    """
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    scale = 1 / 1024**2 if sys.platform == "darwin" else 1 / 1024
+    return {
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1
+        ),
+        "peak_rss_children_mb": round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale, 1
+        ),
+    }
+
+
+def StartRunLogger(path_to_log, start_time=None):
+    """
+    New (empty) log at path_to_log. Returns its RunLogger, which GetRunLogger
+    then returns for the same path.
+    """
+    CloseRunLogger(path_to_log)
+    logger = RunLogger(path_to_log, mode="w", start_time=start_time)
+    _loggers[os.path.abspath(path_to_log)] = logger
+    _FlushAtWorkerExit()
+    return logger
+
+
+def GetRunLogger(path_to_log):
+    """
+    The RunLogger of path_to_log, created (appending to the file) if needed.
+    """
+    key = os.path.abspath(path_to_log)
+    logger = _loggers.get(key)
+    if logger is None:
+        logger = RunLogger(path_to_log)
+        _loggers[key] = logger
+        _FlushAtWorkerExit()
+    return logger
+
+
+def CloseRunLogger(path_to_log):
+    """
+    Writes out what is buffered for path_to_log, e.g. before the file is read.
+    """
+    logger = _loggers.pop(os.path.abspath(path_to_log), None)
+    if logger is not None:
+        logger.flush()
+
+
+# Process id for which the flush at worker exit is registered
+_flush_at_exit_pid = None
+
+
+def _FlushAtWorkerExit():
+    # multiprocessing workers leave through os._exit and never run atexit,
+    # but they do run the multiprocessing finalizers
+    global _flush_at_exit_pid
+    if (
+        multiprocessing.parent_process() is not None
+        and _flush_at_exit_pid != os.getpid()
+    ):
+        _flush_at_exit_pid = os.getpid()
+        multiprocessing.util.Finalize(None, FlushRunLoggers, exitpriority=10)
+
+
+@atexit.register
+def FlushRunLoggers():
+    """
+    Writes out all buffered logs, e.g. before starting worker processes that
+    write to the same files.
+    """
+    for logger in _loggers.values():
+        logger.flush()
@@ -1,9 +1,13 @@
 from importer import *
+from RunLogger import GetRunLogger
+from TargetPosition import GetTargetPosition
+from IndexCache import GetObsIndexCache, GetDataStore
+from GetGeometry import UnitVectors
 
 
 def SelectRuns(path_to_log, args):
-    f = open(path_to_log, "a")
-    data_store = DataStore.from_dir(f"{args.DL3Path}")
+    data_store = GetDataStore(args, path_to_log)
+    f = GetRunLogger(path_to_log)
     # Write the data store info to the log file
     # Capture stdout into a string buffer
     buf = io.StringIO()
@@ -11,100 +15,102 @@ def SelectRuns(path_to_log, args):
         data_store.info()
     # Write the captured output to the log file
     f.write(buf.getvalue())
-    f.write(str(data_store.hdu_table))
+    if args.LogHDUTable:
+        f.write(str(data_store.hdu_table))
+    else:
+        f.write(
+            f"HDU table: {len(data_store.hdu_table)} HDUs (use -LogHDUTable to write the full table to the log)"
+        )
     f.write("\n--------------------------------------------------\n")
     f.write("Data Selection:\n")
     obs_table = data_store.obs_table
     obs_table.sort("OBS_ID")
-    target_position = SkyCoord.from_name(args.ObjectName).icrs
+    f.flush()  # GetTargetPosition also writes to the log
+    target_position = GetTargetPosition(args, path_to_log)
     f.write(f"Target Position: {target_position.to_string('hmsdms')} \n")
     f.write(f"Target Position: {target_position} \n")
     f.write(f"Initial length of obs table: {len(obs_table)} \n")
+    f.flush()  # GetObsIndexCache also writes to the log
+    # Pre-parsed obs index columns (see IndexCache.py), in the row order of obs_table.
+    # Each selection is a boolean mask over these; the runs kept are all of them combined.
+    index = GetObsIndexCache(data_store, args, path_to_log)
+    keep = np.ones(len(obs_table), dtype=bool)
+    predicates = []
+
+    def Select(name, mask, message):
+        keep_before = keep.sum()
+        keep[:] &= mask
+        predicates.append((name, (~mask).sum(), keep_before - keep.sum()))
+        f.write(message + str(keep.sum()) + "\n")
+
     if args.IncludeNearby:
-        selection = dict(
-            type="sky_circle",
-            frame="icrs",
-            lon=f"{target_position.ra.value} deg",
-            lat=f"{target_position.dec.value} deg",
-            radius="5 deg",
-        )
-        obs_table = data_store.obs_table.select_observations(selection)
-        f.write(
-            "Only observations within 5 degrees of the target position kept. Length of obs table after selection: "
-            + str(len(obs_table))
-            + "\n"
+        target_vector = UnitVectors(target_position.ra.deg, target_position.dec.deg)
+        Select(
+            "Pointing within 5 deg of target",
+            index["PNT_XYZ"] @ target_vector > np.cos(np.radians(5)),
+            "Only observations within 5 degrees of the target position kept. Length of obs table after selection: ",
         )
     # Exclude runs that are not in the run list if run list is provided
     if args.RunList == None:
         f.write("No Run List given. All observations kept.\n")
     else:
-        run_list = np.loadtxt(args.RunList, dtype=int)
-        mask = np.isin(obs_table["OBS_ID"], run_list)
-        obs_table = obs_table[mask]
-        f.write(
-            f"Run List given. Length of obs table after selection: {len(obs_table)} \n"
+        run_list = np.loadtxt(args.RunList, dtype=int, ndmin=1)
+        Select(
+            "In run list",
+            np.isin(index["OBS_ID"], run_list),
+            "Run List given. Length of obs table after selection: ",
         )
 
     # Exclude runs in the run exclude list
     if args.RunExcludeList == None:
         f.write("No Runs to Exclude given. All observations kept.\n")
     else:
-        runs_exclude_list = np.loadtxt(args.RunExcludeList, dtype=int)
-        mask = np.isin(obs_table["OBS_ID"], runs_exclude_list)
-        obs_table = obs_table[~mask]
-        f.write(
-            "Runs to Exclude given. Length of obs table after selection: "
-            + str(len(obs_table))
-            + "\n"
+        runs_exclude_list = np.loadtxt(args.RunExcludeList, dtype=int, ndmin=1)
+        Select(
+            "Not in run exclude list",
+            ~np.isin(index["OBS_ID"], runs_exclude_list),
+            "Runs to Exclude given. Length of obs table after selection: ",
         )
     #  Only accept runs with a certain object name
     if args.ObjectName != None and args.IncludeNearby == False:
-        mask = obs_table["OBJECT"] == args.ObjectName
-        obs_table = obs_table[mask]
-        f.write(
+        Select(
+            f"OBJECT is {args.ObjectName}",
+            index["OBJECT_NAMES"][index["OBJECT_CODE"]] == args.ObjectName,
             "Only observations with OBJECT name "
             + args.ObjectName
-            + " kept. Length of obs table after selection: "
-            + str(len(obs_table))
-            + "\n"
+            + " kept. Length of obs table after selection: ",
         )
 
-    if len(obs_table) == 0:
+    if keep.sum() == 0:
+        WriteSelectionExplanation(predicates, len(obs_table), args, path_to_log, f)
         raise ValueError(
             "No observations selected. Please check your selection criteria."
         )
 
     #  Only accept runs after a certain date
     if args.FromDate != None:
-        FromDate = Time(args.FromDate).mjd
-        mask = Time(obs_table["DATE-OBS"]).mjd >= FromDate
-        obs_table = obs_table[mask]
-        f.write(
+        Select(
+            f"On or after {args.FromDate}",
+            index["MJD"] >= Time(args.FromDate).mjd,
             "Only observations after "
             + args.FromDate
-            + " kept. Length of obs table after selection: "
-            + str(len(obs_table))
-            + "\n"
-        )
-    if len(obs_table) == 0:
-        raise ValueError(
-            "No observations selected. Please check your selection criteria."
+            + " kept. Length of obs table after selection: ",
         )
 
     #  Only accept runs before a certain date
     if args.ToDate != None:
-        ToDate = Time(args.ToDate).mjd
-        mask = Time(obs_table["DATE-OBS"]).mjd <= ToDate
-        obs_table = obs_table[mask]
-        f.write(
+        Select(
+            f"On or before {args.ToDate}",
+            index["MJD"] <= Time(args.ToDate).mjd,
             "Only observations before "
             + args.ToDate
-            + " kept. Length of obs table after selection: "
-            + str(len(obs_table))
-            + "\n"
+            + " kept. Length of obs table after selection: ",
         )
+    obs_table = obs_table[keep]
+    WriteSelectionExplanation(predicates, len(keep), args, path_to_log, f)
 
-    observations = data_store.get_observations(
+    observations = LazyObservations(
+        data_store,
         obs_table["OBS_ID"],
         required_irf="point-like",  # includes ["events", "gti", "aeff", "edisp"]
     )
@@ -112,9 +118,73 @@ def SelectRuns(path_to_log, args):
     f.write("--------------------------------------------------\n")
     f.write("Observations kept: \n" + str(np.array(obs_table["OBS_ID"])) + "\n")
     f.write("--------------------------------------------------\n")
-    f.close()
     if len(obs_table) == 0:
         raise ValueError(
             "No observations selected. Please check your selection criteria."
         )
-    return obs_table, observations, target_position, obs_ids
+    return obs_table, observations, target_position, obs_ids, data_store
+
+
+def WriteSelectionExplanation(predicates, n_runs, args, path_to_log, f):
+    """
+    With -ExplainSelection, write how many runs each selection removed: on its
+    own ("Failing") and in the order they are applied ("Removed").
+    """
+    if not args.ExplainSelection:
+        return
+    explanation = Table(
+        rows=predicates,
+        names=("Selection", "Failing", "Removed"),
+        dtype=(str, int, int),
+    )
+    explanation["Remaining"] = n_runs - np.cumsum(explanation["Removed"])
+    text = "\n".join(explanation.pformat(max_lines=-1, max_width=-1))
+    f.write(f"Selection explained (starting from {n_runs} runs):\n{text}\n")
+    print(f"Selection explained (starting from {n_runs} runs):\n{text}")
+
+
+def GetRunFiles(data_store, obs_id):
+    """
+    Returns the sorted list of files holding the HDUs (events, gti, IRFs) of a run.
+    """
+    hdu_table = data_store.hdu_table
+    rows = np.nonzero(hdu_table["OBS_ID"] == obs_id)[0]
+    return sorted({str(hdu_table.location_info(idx).path()) for idx in rows})
+
+
+class LazyObservations:
+    """
+    Lazy replacement for data_store.get_observations(obs_ids, required_irf).
+    Indexing or iterating returns a new Observation each time, whose events and
+    IRFs are only read from disk when a maker first uses them (uncompressed FITS
+    files are memory-mapped by astropy). Nothing is kept here, so a run's data
+    is released once the caller is done with it (e.g. after its dataset is
+    built) and memory stays bounded by one run, not the whole run list.
+    """
+
+    def __init__(self, data_store, obs_ids, required_irf="point-like"):
+        self.data_store = data_store
+        self.required_irf = required_irf
+        self._obs_ids = [int(obs_id) for obs_id in obs_ids]
+        # Fail now, as get_observations would, if a run is missing a required HDU.
+        # This only looks up the HDU index, no data are read.
+        for obs_id in self._obs_ids:
+            data_store.obs(obs_id, required_irf=required_irf)
+
+    @property
+    def ids(self):
+        return [str(obs_id) for obs_id in self._obs_ids]
+
+    def __len__(self):
+        return len(self._obs_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazyObservations(
+                self.data_store, self._obs_ids[index], required_irf=self.required_irf
+            )
+        return self.data_store.obs(self._obs_ids[index], required_irf=self.required_irf)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
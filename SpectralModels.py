@@ -1,6 +1,10 @@
 from uncertainties import ufloat
 import numpy as np
 
+# Crab reference spectrum used by CrabIntegralFluxPowerLaw
+CRAB_GAMMA = 2.64
+CRAB_PHI_0 = 3.19e-11
+
 
 def DefiniteIntegralPowerLaw(
     # Use ufloats to get uncertainties on the parameters
@@ -57,7 +61,82 @@ def CrabIntegralFluxPowerLaw(E_l, E_r):
     return DefiniteIntegralPowerLaw(
         E_l=E_l,
         E_r=E_r,
-        Gamma=ufloat(2.64, 0),
-        Phi_0=ufloat(3.19e-11, 0),
+        Gamma=ufloat(CRAB_GAMMA, 0),
+        Phi_0=ufloat(CRAB_PHI_0, 0),
         E_0=ufloat(1, 0),
     )
+
+
+### Vectorised versions of the above for arrays of energies.
+### Parameters are plain floats; the 1 sigma band comes from linear error propagation
+### with the full covariance matrix (which ufloat does not handle).
+
+
+def CovarianceMatrix(errors, correlation=None):
+    """
+    Covariance matrix from the parameter errors and (optionally) their correlation matrix.
+    """
+    errors = np.asarray(errors, dtype=float)
+    if correlation is None:
+        return np.diag(errors**2)
+    return np.asarray(correlation, dtype=float) * np.outer(errors, errors)
+
+
+def PropagateErrors(jacobian, covariance):
+    """
+    1 sigma error of a function from its jacobian (..., n_parameters) and the
+    parameter covariance matrix (n_parameters, n_parameters).
+    """
+    jacobian = np.asarray(jacobian, dtype=float)
+    variance = np.einsum("...i,ij,...j->...", jacobian, covariance, jacobian)
+    return np.sqrt(np.clip(variance, 0, None))
+
+
+def PowerLawBand(E, index, normalisation, covariance=None, E_ref=1.0):
+    """
+    Power law (as PowerLawFunction) and its 1 sigma error for an array of energies.
+    covariance is the covariance matrix of (normalisation, index), e.g.
+    CovarianceMatrix([normalisation_err, index_err]). Without it the error is zero.
+    Returns (value, error)
+    """
+    E = np.asarray(E, dtype=float)
+    scaled = (E / E_ref) ** index
+    value = normalisation * scaled
+    if covariance is None:
+        return value, np.zeros_like(value)
+    jacobian = np.stack([scaled, value * np.log(E / E_ref)], axis=-1)
+    return value, PropagateErrors(jacobian, covariance)
+
+
+def DefiniteIntegralPowerLawBand(E_l, E_r, Gamma, Phi_0, E_0, covariance=None):
+    """
+    DefiniteIntegralPowerLaw and its 1 sigma error for arrays of E_l and E_r.
+    covariance is the covariance matrix of (Phi_0, Gamma).
+    Returns (value, error)
+    """
+    E_l = np.asarray(E_l, dtype=float)
+    E_r = np.asarray(E_r, dtype=float)
+    upper = E_r ** (Gamma + 1)
+    lower = E_l ** (Gamma + 1)
+    prefactor = Phi_0 / ((Gamma + 1) * (E_0**Gamma))
+    value = prefactor * (upper - lower)
+    if covariance is None:
+        return value, np.zeros_like(value)
+    dIdPhi_0 = value / Phi_0
+    dIdGamma = (
+        -np.log(E_0) * value
+        - value / (Gamma + 1)
+        + prefactor * (upper * np.log(E_r) - lower * np.log(E_l))
+    )
+    jacobian = np.stack(np.broadcast_arrays(dIdPhi_0, dIdGamma), axis=-1)
+    return value, PropagateErrors(jacobian, covariance)
+
+
+def CrabIntegralFluxPowerLawBand(E_l, E_r):
+    """
+    CrabIntegralFluxPowerLaw for arrays of E_l and E_r (the reference has no errors).
+    """
+    value, _ = DefiniteIntegralPowerLawBand(
+        E_l=E_l, E_r=E_r, Gamma=CRAB_GAMMA, Phi_0=CRAB_PHI_0, E_0=1.0
+    )
+    return value
@@ -1,4 +1,5 @@
 from importer import *
+from RunLogger import GetRunLogger
 
 
 def MakeSpectralVariabilityPlots(fit_results, time_bins, path_to_log, args):
@@ -7,7 +8,7 @@ def MakeSpectralVariabilityPlots(fit_results, time_bins, path_to_log, args):
     IndexErr = []
     Norm = []
     NormErr = []
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("--------------------------------------------------\n")
         f.write("Spectral Variability: \n")
         f.write(
@@ -1,4 +1,8 @@
 from importer import *
+from RunLogger import GetRunLogger, StartRunLogger, CloseRunLogger
+from Parallel import ParallelMap, GetShared
+from DataReduction import RunDataReductionChain
+from DatasetStats import SelectRunStats
 
 
 def SpectrumTimeBins(args):
@@ -19,3 +23,132 @@ def SpectrumTimeBins(args):
         print(f"Error reading time bin file: {e}")
         sys.exit(1)
     return time_bins
+
+
+def SelectTimeBinDatasets(datasets, masks_not_safe, tmin, tmax):
+    """
+    Copies of the already reduced per-run datasets whose run starts in [tmin, tmax] (MJD).
+    If an observation crosses the time bin edge it is included in the first time bin (i.e. we look at tstart not tstop).
+    Returns the Datasets and the matching pre-safe-mask masks.
+    """
+    selected = Datasets()
+    selected_masks_not_safe = {}
+    for dataset in datasets:
+        tstart = dataset.gti.time_start[0].mjd
+        if tstart >= tmin and tstart <= tmax:
+            # Copy so that this time bin's model does not overwrite the full dataset's
+            selected.append(dataset.copy(name=dataset.name))
+            selected_masks_not_safe[dataset.name] = masks_not_safe[dataset.name]
+    return selected, selected_masks_not_safe
+
+
+def RunTimeBins(
+    time_bins,
+    datasets,
+    masks_not_safe,
+    run_stats,
+    run_stats_not_safe,
+    geom,
+    energy_axis,
+    energy_axis_true,
+    exclusion_mask,
+    path_to_log,
+    args,
+    on_region_radius,
+    n_jobs=None,
+):
+    """
+    Fit and flux points for each time bin, using the already reduced per-run datasets.
+    The bins are independent, so they are run in parallel on n_jobs processes
+    (default -NJobs). Each bin
+    writes its own SpectralVariability/TimeBin_*/log.txt, which is appended to the
+    main log in bin order once all bins are done.
+    Returns the fit results and the (tmin, tmax) of the bins that were not empty.
+    """
+    bins = []
+    for i, (tmin, tmax) in enumerate(time_bins):
+        time_bin_datasets, time_bin_masks_not_safe = SelectTimeBinDatasets(
+            datasets, masks_not_safe, tmin, tmax
+        )
+        bins.append(
+            (
+                tmin,
+                tmax,
+                time_bin_datasets,
+                time_bin_masks_not_safe,
+                SelectRunStats(run_stats, time_bin_datasets.names),
+                SelectRunStats(run_stats_not_safe, time_bin_datasets.names),
+            )
+        )
+    to_run = [i for i, time_bin in enumerate(bins) if len(time_bin[2]) > 0]
+    results = ParallelMap(
+        _RunTimeBinWorker,
+        to_run,
+        n_jobs=args.NJobs if n_jobs is None else n_jobs,
+        shared=dict(
+            bins=bins,
+            geom=geom,
+            energy_axis=energy_axis,
+            energy_axis_true=energy_axis_true,
+            exclusion_mask=exclusion_mask,
+            args=args,
+            on_region_radius=on_region_radius,
+        ),
+    )
+    results = dict(zip(to_run, results))
+
+    fit_results = []
+    fit_time_bins = []
+    for i, (tmin, tmax, *_) in enumerate(bins):
+        if i not in results:
+            with GetRunLogger(path_to_log) as f:
+                f.write(
+                    f"Skipping timebin_{i}: no observations in MJD range {tmin}-{tmax}\n"
+                )
+            continue
+        fit_result, time_bin_log = results[i]
+        with open(time_bin_log, "r") as f_bin, GetRunLogger(path_to_log) as f:
+            f.write(
+                f"Running Data Reduction Chain for observations from {tmin} to {tmax}\n"
+            )
+            f.write(f_bin.read())
+        fit_results.append(fit_result)
+        fit_time_bins.append((tmin, tmax))
+    return fit_results, fit_time_bins
+
+
+def _RunTimeBinWorker(index):
+    # Runs in a ParallelMap worker, see RunTimeBins
+    shared = GetShared()
+    (
+        tmin,
+        tmax,
+        time_bin_datasets,
+        time_bin_masks_not_safe,
+        time_bin_run_stats,
+        time_bin_run_stats_not_safe,
+    ) = shared["bins"][index]
+    args = shared["args"]
+    WorkingDir = os.path.join(args.ADir, f"SpectralVariability/TimeBin_{tmin}_{tmax}")
+    os.makedirs(WorkingDir, exist_ok=True)
+    time_bin_log = os.path.join(WorkingDir, "log.txt")
+    StartRunLogger(time_bin_log)
+    fit_result, _ = RunDataReductionChain(
+        shared["geom"],
+        shared["energy_axis"],
+        shared["energy_axis_true"],
+        shared["exclusion_mask"],
+        None,
+        time_bin_datasets.names,
+        time_bin_log,
+        args,
+        shared["on_region_radius"],
+        tmin=tmin,
+        tmax=tmax,
+        datasets=time_bin_datasets,
+        masks_not_safe=time_bin_masks_not_safe,
+        run_stats=time_bin_run_stats,
+        run_stats_not_safe=time_bin_run_stats_not_safe,
+    )
+    CloseRunLogger(time_bin_log)
+    return fit_result, time_bin_log
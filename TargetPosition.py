@@ -0,0 +1,96 @@
+from importer import *
+from RunLogger import GetRunLogger
+from Cache import GetCacheDir
+
+# Positions already resolved in this process, keyed by normalised name
+_resolved = {}
+
+
+def GetTargetPosition(args, path_to_log):
+    """
+    ICRS SkyCoord of args.ObjectName, looked up in this order:
+      1. -TargetPositionsCSV (manual overrides: name, ra (deg), dec (deg). No header is required.)
+      2. <CacheDir>/TargetPositions.ecsv (names resolved by earlier analyses, also
+         used with -NoCache so that offline nodes do not need Sesame)
+      3. SkyCoord.from_name (Sesame, needs network). The result is added to the cache.
+    Each name is only resolved once per process.
+    """
+    key = NormaliseName(args.ObjectName)
+    if key in _resolved:
+        return _resolved[key]
+
+    target_position = None
+    if args.TargetPositionsCSV is not None:
+        overrides = ReadTargetPositionsTable(args.TargetPositionsCSV, format="csv")
+        target_position = LookUpTargetPosition(overrides, key)
+        source = f"override file {args.TargetPositionsCSV}"
+
+    cache_path = os.path.join(
+        GetCacheDir(args, ignore_no_cache=True), "TargetPositions.ecsv"
+    )
+    if target_position is None and os.path.exists(cache_path):
+        cached = ReadTargetPositionsTable(cache_path, format="ecsv")
+        target_position = LookUpTargetPosition(cached, key)
+        source = f"cache {cache_path}"
+
+    if target_position is None:
+        try:
+            target_position = SkyCoord.from_name(args.ObjectName).icrs
+        except Exception as e:
+            raise ValueError(
+                f"Could not resolve the position of {args.ObjectName} ({e}). "
+                "Without network access give it in -TargetPositionsCSV."
+            )
+        source = "Sesame"
+        AddToTargetPositionsCache(cache_path, args.ObjectName, target_position)
+
+    with GetRunLogger(path_to_log) as f:
+        f.write(f"Target Position of {args.ObjectName} taken from {source}\n")
+    _resolved[key] = target_position
+    return target_position
+
+
+def NormaliseName(name):
+    # Sesame names are case and whitespace insensitive
+    return " ".join(str(name).split()).lower()
+
+
+def ReadTargetPositionsTable(path, format="ecsv"):
+    if format == "csv":
+        table = Table.read(
+            path,
+            format="ascii.no_header",
+            delimiter=",",
+            names=("name", "ra", "dec"),
+        )
+        # Allow (and drop) a header line
+        table = table[[NormaliseName(name) != "name" for name in table["name"]]]
+        table["ra"] = np.asarray(table["ra"], dtype=float)
+        table["dec"] = np.asarray(table["dec"], dtype=float)
+        return table
+    return Table.read(path, format="ascii.ecsv")
+
+
+def LookUpTargetPosition(table, key):
+    # Last entry wins so that a later line overrides an earlier one
+    for row in table[::-1]:
+        if NormaliseName(row["name"]) == key:
+            return SkyCoord(row["ra"], row["dec"], unit="deg", frame="icrs")
+    return None
+
+
+def AddToTargetPositionsCache(cache_path, name, target_position):
+    names, ras, decs = [], [], []
+    if os.path.exists(cache_path):
+        cached = ReadTargetPositionsTable(cache_path, format="ecsv")
+        names, ras, decs = list(cached["name"]), list(cached["ra"]), list(cached["dec"])
+    names.append(str(name))
+    ras.append(target_position.ra.deg)
+    decs.append(target_position.dec.deg)
+    table = Table(
+        [names, ras, decs], names=("name", "ra", "dec"), units=(None, u.deg, u.deg)
+    )
+    # Write then rename so that a reader never sees a partly written file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    table.write(tmp_path, format="ascii.ecsv", overwrite=True)
+    os.replace(tmp_path, cache_path)
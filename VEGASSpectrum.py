@@ -5,7 +5,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import argparse
 from uncertainties import ufloat
-from SpectralModels import PowerLawFunction
+from SpectralModels import CovarianceMatrix, PowerLawBand
+from VEGASStage6Log import parse_stage6_log
 
 
 def vegas_spectrum(
@@ -26,69 +27,10 @@ def vegas_spectrum(
         logf.write("VEGAS Spectral Model Results (for comparison) \n")
         logf.close()
 
-    all_data = pd.DataFrame()
-    RelevantData = False
-
-    # Columns are now defined outside of conditionals
-    columns = [
-        "Bin",
-        "Energy",
-        "E_error",
-        "Flux",
-        "Flux_error",
-        "Non",
-        "Noff",
-        "Nexcess",
-        "RawOff",
-        "Alpha",
-        "Sig",
-        "Low_Edge",
-        "High_Edge",
-    ]
-
-    with open(file_path, "r") as f:
-        for line in f:
-            stripped_line = line.strip()
-            split_line = line.split()
-
-            if (
-                stripped_line
-                == "Bin    Energy    error     Flux    error  Non    Noff Nexcess  RawOff Alpha    Sig  Low Edge High Edge"
-            ):
-                RelevantData = True
-            elif stripped_line == "****************************************":
-                RelevantData = False
-            elif RelevantData:
-                if len(split_line) == 14:  # Spectrum data point
-                    new_row = pd.DataFrame([split_line[1:]], columns=columns)
-                    new_row["is_upper_limit"] = False
-                    all_data = pd.concat([all_data, new_row], ignore_index=True)
-                elif len(split_line) == 13:  # Upper limit
-                    new_row = pd.DataFrame([split_line], columns=columns)
-                    new_row["is_upper_limit"] = True
-                    all_data = pd.concat([all_data, new_row], ignore_index=True)
-            if line.strip()[0:4] == "Norm":
-                v_norm = ufloat(float(line.split()[2]), float(line.split()[4]))
-            if line.strip()[0:5] == "Index":
-                v_index = ufloat(float(line.split()[2]), float(line.split()[4]))
-
-    # Convert columns to correct dtypes
-    float_columns = [
-        "Energy",
-        "E_error",
-        "Flux",
-        "Flux_error",
-        "Non",
-        "Noff",
-        "Nexcess",
-        "RawOff",
-        "Alpha",
-        "Sig",
-        "Low_Edge",
-        "High_Edge",
-    ]
-    all_data["Bin"] = all_data["Bin"].astype("int32")
-    all_data[float_columns] = all_data[float_columns].astype("float64")
+    points, parameters = parse_stage6_log(file_path)
+    all_data = pd.DataFrame(points)
+    v_norm = ufloat(*parameters["Norm"])
+    v_index = ufloat(*parameters["Index"])
 
     # Fix yerr for plotting: set Flux_error to 0 for upper limits to avoid errors
     safe_yerr = all_data["Flux_error"].copy()
@@ -96,41 +38,25 @@ def vegas_spectrum(
         0.5 * all_data["Flux"]
     )  # Set to 50% of flux for upper limits
 
-    # VEGAS Power Law
+    # VEGAS Power Law (Stage 6 gives no correlation between Norm and Index)
+    (norm, norm_err), (index, index_err) = parameters["Norm"], parameters["Index"]
+    covariance = CovarianceMatrix([norm_err, index_err])
     energy_vals = np.logspace(-1, 2, 10000)
-    VEGAS_PL_val = []
-    VEGAS_PL_err = []
-    VEGAS_PL = PowerLawFunction(
-        index=v_index, E=energy_vals, normalisation=v_norm / 10000
+    VEGAS_PL_val, VEGAS_PL_err = PowerLawBand(  # Per m^2 -> per cm^2
+        energy_vals,
+        index,
+        norm / 10000,
+        covariance=CovarianceMatrix([norm_err / 10000, index_err]),
     )
-    for val in VEGAS_PL:
-        VEGAS_PL_val.append(val.nominal_value)
-        VEGAS_PL_err.append(val.std_dev)
-    VEGAS_PL_val = np.array(VEGAS_PL_val)
-    VEGAS_PL_err = np.array(VEGAS_PL_err)
-
-    # VEGAS Residuals
-    v_residuals = []
-    v_energy = []
-    v_flux = []
-    for i in range(0, len(all_data)):
-        if not all_data.iloc[i]["is_upper_limit"]:
-            v_energy.append(
-                all_data.iloc[i]["Energy"],
-            )
-            v_flux.append(
-                ufloat(
-                    all_data.iloc[i]["Flux"],
-                    all_data.iloc[i]["Flux_error"],
-                )
-            )
-    v_flux = np.array(v_flux)
-    v_energy = np.array(v_energy)
-    model_for_residuals = PowerLawFunction(v_energy, v_index, v_norm)
 
-    v_residuals = (v_flux - model_for_residuals) / model_for_residuals
-    v_residuals_val = [val.n for val in v_residuals]
-    v_residuals_std = [val.s for val in v_residuals]
+    # VEGAS Residuals: (flux - model) / model, with the errors of both
+    flux_points = all_data[~all_data["is_upper_limit"]]
+    v_energy = flux_points["Energy"].to_numpy()
+    v_flux = flux_points["Flux"].to_numpy()
+    v_flux_err = flux_points["Flux_error"].to_numpy()
+    model, model_err = PowerLawBand(v_energy, index, norm, covariance=covariance)
+    v_residuals_val = (v_flux - model) / model
+    v_residuals_std = np.hypot(v_flux_err / model, v_flux * model_err / model**2)
 
     if log_file is not None:
         logf = open(log_file, "a")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import argparse
+import numpy as np
+
+STAGE6_HEADER = "Bin    Energy    error     Flux    error  Non    Noff Nexcess  RawOff Alpha    Sig  Low Edge High Edge"
+STAGE6_END = "****************************************"
+STAGE6_COLUMNS = [
+    "Bin",
+    "Energy",
+    "E_error",
+    "Flux",
+    "Flux_error",
+    "Non",
+    "Noff",
+    "Nexcess",
+    "RawOff",
+    "Alpha",
+    "Sig",
+    "Low_Edge",
+    "High_Edge",
+]
+STAGE6_DTYPE = np.dtype(
+    [("Bin", np.int32)]
+    + [(column, np.float64) for column in STAGE6_COLUMNS[1:]]
+    + [("is_upper_limit", bool)]
+)
+# Fit parameter lines: "Norm = <value> +/- <error>"
+STAGE6_PARAMETERS = ("Norm", "Index")
+
+
+def parse_stage6_log(path):
+    """
+    Reads the spectral points and the power law fit of a VEGAS Stage 6 log in one pass.
+    Returns (points, parameters):
+      points: structured array with the STAGE6_COLUMNS and is_upper_limit
+              (rows with 14 fields are flux points, rows with 13 are upper limits)
+      parameters: {"Norm": (value, error), "Index": (value, error)}, as in the log
+              (Norm in VEGAS units, i.e. per m^2, Index with its negative sign)
+
+    Example usage:
+        points, parameters = parse_stage6_log("Stage6.log")
+        all_data = pd.DataFrame(points)
+    """
+    rows = []
+    upper_limit = []
+    parameters = {}
+    relevant_data = False
+    with open(path, "r") as f:
+        for line in f:
+            stripped_line = line.strip()
+            if not stripped_line:
+                continue
+            if stripped_line == STAGE6_HEADER:
+                relevant_data = True
+                continue
+            if stripped_line == STAGE6_END:
+                relevant_data = False
+                continue
+            split_line = stripped_line.split()
+            if relevant_data:
+                if len(split_line) == 14:  # Spectrum data point
+                    rows.append(split_line[1:])
+                    upper_limit.append(False)
+                elif len(split_line) == 13:  # Upper limit
+                    rows.append(split_line)
+                    upper_limit.append(True)
+            for name in STAGE6_PARAMETERS:
+                if stripped_line.startswith(name):
+                    parameters[name] = (float(split_line[2]), float(split_line[4]))
+
+    # Convert the collected strings column by column
+    points = np.zeros(len(rows), dtype=STAGE6_DTYPE)
+    if rows:
+        fields = np.array(rows, dtype=str)
+        for i, column in enumerate(STAGE6_COLUMNS):
+            points[column] = fields[:, i].astype(STAGE6_DTYPE[column])
+    points["is_upper_limit"] = upper_limit
+    return points, parameters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Print the spectral points and fit of a VEGAS Stage 6 log."
+    )
+    parser.add_argument("file_path", help="Path to the VEGAS Stage 6 log file.")
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    points, parameters = parse_stage6_log(args.file_path)
+    print(pd.DataFrame(points))
+    for name, (value, error) in parameters.items():
+        print(f"{name} = {value} +/- {error}")
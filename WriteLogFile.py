@@ -1,14 +1,10 @@
 import sys
-
-sys.path.append("/Users/nickibond/Documents/Research/Toolkit")
 from importer import *
-from AddArguments import get_parser
-
-args = get_parser().parse_args()
+from RunLogger import GetRunLogger
 
 
 def WritePackageVersionsToLog(path_to_log):
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("Packages used:\n")
         f.write("Python version: " + sys.version + "\n")
         f.write("Numpy version: " + np.__version__ + "\n")
@@ -23,8 +19,8 @@ def WritePackageVersionsToLog(path_to_log):
         f.write("--------------------------------------------------\n")
 
 
-def WriteInputParametersToLog(path_to_log):
-    with open(path_to_log, "a") as f:
+def WriteInputParametersToLog(path_to_log, args):
+    with GetRunLogger(path_to_log) as f:
         f.write("Input Parameters:\n")
         for arg_name, arg_value in vars(args).items():
             f.write(f"{arg_name}: {arg_value}\n")
@@ -33,12 +29,12 @@ def WriteInputParametersToLog(path_to_log):
 
 def WriteIntegralFluxToLog(fit_result, args, path_to_log, tmin=None, tmax=None):
     if tmin != None and tmax != None:
-        with open(path_to_log, "a") as f:
+        with GetRunLogger(path_to_log) as f:
             f.write(
                 "Integral Flux for time bin " + str(tmin) + " to " + str(tmax) + ":  \n"
             )
     else:
-        with open(path_to_log, "a") as f:
+        with GetRunLogger(path_to_log) as f:
             f.write("-----------------------------------\n")
             f.write("Integral Flux: \n")
             result = fit_result.models[args.ObjectName].spectral_model.integral_error(
@@ -61,7 +57,7 @@ def WriteIntegralFluxToLog(fit_result, args, path_to_log, tmin=None, tmax=None):
     # )
 
     # CrabFlux=CrabIntegralFluxPowerLaw(E_l=ufloat(args.IntegralFluxMinEnergy, 0),E_r=ufloat(10000000, 0))
-    # with open(path_to_log, "a") as f:
+    # with GetRunLogger(path_to_log) as f:
     #     f.write(
     #         "Minimum Energy for Integral Flux: " + str(args.IntegralFluxMinEnergy) + " TeV \n"
     #     )
@@ -78,7 +74,7 @@ def WriteSignificanceToLog(stacked, path_to_log, tmin=None, tmax=None):
     # n_on = stacked.counts.data.sum()
     # n_off = stacked.counts_off.data.sum()
     # alpha = stacked.alpha.data.mean()
-    with open(path_to_log, "a") as f:
+    with GetRunLogger(path_to_log) as f:
         f.write("--------------------------------------------------\n")
         if tmin != None and tmax != None:
             f.write(f"Significance for observations from {tmin} to {tmax}\n")
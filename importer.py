@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
+"""
+Names shared by the pipeline modules through `from importer import *`.
+
+Only the standard library and numpy are imported here. Everything else is a
+lazy stand-in that imports the real module (or class / function) the first
+time it is used, so that a module (or a `-h` call) only pays for the packages
+it actually touches. Check the start-up cost with CheckImportTime.py.
+"""
 
 # Standard Library
 import os
 import argparse
 import re
 import warnings
+import importlib
 from datetime import datetime
 import io
 from contextlib import redirect_stdout
@@ -13,62 +22,212 @@ from pathlib import Path
 
 # Scientific / Numeric Libraries
 import numpy as np
-import pandas as pd
-import scipy
-from uncertainties import ufloat
+
+
+class LazyModule:
+    """
+    Stands in for the module `name` until one of its attributes is used.
+    on_load is called (once) after it is imported.
+    """
+
+    def __init__(self, name, on_load=None):
+        object.__setattr__(self, "_lazy_name", name)
+        object.__setattr__(self, "_lazy_on_load", on_load)
+        object.__setattr__(self, "_lazy_target", None)
+
+    def _Load(self):
+        target = object.__getattribute__(self, "_lazy_target")
+        if target is None:
+            target = self._Import()
+            object.__setattr__(self, "_lazy_target", target)
+            on_load = object.__getattribute__(self, "_lazy_on_load")
+            if on_load is not None:
+                on_load()
+        return target
+
+    def _Import(self):
+        return importlib.import_module(self._lazy_name)
+
+    def __getattr__(self, attr):
+        return getattr(self._Load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._Load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._Load())
+
+    def __repr__(self):
+        if self._lazy_target is None:
+            return f"<lazy {self._lazy_name}>"
+        return repr(self._lazy_target)
+
+
+class LazyAttribute(LazyModule):
+    """
+    Stands in for `module.attr` (a class or function) until it is used:
+    called, an attribute looked up, used in isinstance or subclassed.
+    """
+
+    def __init__(self, module, attr, on_load=None):
+        super().__init__(module, on_load)
+        object.__setattr__(self, "_lazy_attr", attr)
+
+    def _Import(self):
+        return getattr(importlib.import_module(self._lazy_name), self._lazy_attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._Load()(*args, **kwargs)
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self._Load())
+
+    def __subclasscheck__(self, subclass):
+        return issubclass(subclass, self._Load())
+
+    def __mro_entries__(self, bases):
+        return (self._Load(),)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyAttribute):
+            other = other._Load()
+        return self._Load() == other
+
+    def __hash__(self):
+        return hash(self._Load())
+
+    def __repr__(self):
+        if self._lazy_target is None:
+            return f"<lazy {self._lazy_name}.{self._lazy_attr}>"
+        return repr(self._lazy_target)
+
+
+# Suppress unnecessary warnings (the ErfaWarning one is set up with astropy):
+warnings.filterwarnings("ignore", message=".*color.*property will override.*")
+
+# Set-up steps (plot style, warning filters) already run
+_set_up = set()
+
+
+def _SetUpPlotting():
+    # Plot Style
+    if "plotting" not in _set_up:
+        _set_up.add("plotting")
+        import matplotlib.style
+
+        matplotlib.style.use("tableau-colorblind10")
+
+
+def _SetUpAstropy():
+    if "astropy" not in _set_up:
+        _set_up.add("astropy")
+        from erfa import ErfaWarning
+
+        warnings.filterwarnings(
+            "ignore", message=".*dubious year.*", category=ErfaWarning
+        )
+
+
+def _SetUpGammapy():
+    # gammapy plots and uses astropy times, so it gets both
+    _SetUpAstropy()
+    _SetUpPlotting()
+
+
+def _LazyNames(module, names, on_load=None):
+    return {name: LazyAttribute(module, name, on_load) for name in names}
+
+
+pd = LazyModule("pandas")
+scipy = LazyModule("scipy")
+ufloat = LazyAttribute("uncertainties", "ufloat")
+xlogy = LazyAttribute("scipy.special", "xlogy")
+cKDTree = LazyAttribute("scipy.spatial", "cKDTree")
 
 # Plotting / Visualization
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.style as style
-import matplotlib.ticker as ticker
-from matplotlib.collections import PolyCollection
+matplotlib = LazyModule("matplotlib", _SetUpPlotting)
+plt = LazyModule("matplotlib.pyplot", _SetUpPlotting)
+style = LazyModule("matplotlib.style", _SetUpPlotting)
+ticker = LazyModule("matplotlib.ticker", _SetUpPlotting)
+PolyCollection = LazyAttribute("matplotlib.collections", "PolyCollection")
 
 # Astropy
-import astropy
-import astropy.units as u
-from astropy.table import Table
-from astropy.time import Time, TimeDelta
-from astropy.coordinates import SkyCoord, angular_separation
+astropy = LazyModule("astropy", _SetUpAstropy)
+u = LazyModule("astropy.units", _SetUpAstropy)
+fits = LazyModule("astropy.io.fits", _SetUpAstropy)
+globals().update(_LazyNames("astropy.table", ["Table", "vstack"], _SetUpAstropy))
+globals().update(_LazyNames("astropy.time", ["Time", "TimeDelta"], _SetUpAstropy))
+globals().update(
+    _LazyNames("astropy.coordinates", ["SkyCoord", "angular_separation"], _SetUpAstropy)
+)
 
 # Regions & Sky
-import regions
-from regions import CircleSkyRegion
+regions = LazyModule("regions")
+CircleSkyRegion = LazyAttribute("regions", "CircleSkyRegion")
 
 # Astroquery
-import astroquery
-from astroquery.vizier import Vizier
+astroquery = LazyModule("astroquery")
+Vizier = LazyAttribute("astroquery.vizier", "Vizier")
 
 # Gammapy
-import gammapy
-from gammapy.data import DataStore
-from gammapy.maps import MapAxis, RegionGeom, WcsGeom, TimeMapAxis
-from gammapy.datasets import SpectrumDataset, Datasets, FluxPointsDataset
-from gammapy.makers import (
-    SpectrumDatasetMaker,
-    ReflectedRegionsBackgroundMaker,
-    SafeMaskMaker,
+gammapy = LazyModule("gammapy", _SetUpGammapy)
+make_path = LazyAttribute("gammapy.utils.scripts", "make_path", _SetUpGammapy)
+globals().update(
+    _LazyNames(
+        "gammapy.data",
+        ["DataStore", "HDUIndexTable", "ObservationTable"],
+        _SetUpGammapy,
+    )
 )
-from gammapy.modeling import Fit
-from gammapy.modeling.models import (
-    PowerLawSpectralModel,
-    SkyModel,
-    Models,
-    LogParabolaSpectralModel,
-    BrokenPowerLawSpectralModel,
-    SmoothBrokenPowerLawSpectralModel,
-    ConstantTemporalModel,
-    CompoundSpectralModel,
+globals().update(
+    _LazyNames(
+        "gammapy.maps",
+        ["Map", "MapAxis", "RegionGeom", "WcsGeom", "TimeMapAxis"],
+        _SetUpGammapy,
+    )
+)
+globals().update(
+    _LazyNames(
+        "gammapy.datasets",
+        ["SpectrumDataset", "SpectrumDatasetOnOff", "Datasets", "FluxPointsDataset"],
+        _SetUpGammapy,
+    )
+)
+globals().update(
+    _LazyNames(
+        "gammapy.makers",
+        [
+            "SpectrumDatasetMaker",
+            "ReflectedRegionsBackgroundMaker",
+            "SafeMaskMaker",
+        ],
+        _SetUpGammapy,
+    )
+)
+Fit = LazyAttribute("gammapy.modeling", "Fit", _SetUpGammapy)
+globals().update(
+    _LazyNames(
+        "gammapy.modeling.models",
+        [
+            "PowerLawSpectralModel",
+            "SkyModel",
+            "Models",
+            "LogParabolaSpectralModel",
+            "BrokenPowerLawSpectralModel",
+            "SmoothBrokenPowerLawSpectralModel",
+            "ConstantTemporalModel",
+            "CompoundSpectralModel",
+        ],
+        _SetUpGammapy,
+    )
+)
+globals().update(
+    _LazyNames(
+        "gammapy.estimators",
+        ["FluxPointsEstimator", "LightCurveEstimator"],
+        _SetUpGammapy,
+    )
+)
+plot_spectrum_datasets_off_regions = LazyAttribute(
+    "gammapy.visualization", "plot_spectrum_datasets_off_regions", _SetUpGammapy
 )
-from gammapy.estimators import FluxPointsEstimator, LightCurveEstimator
-from gammapy.visualization import plot_spectrum_datasets_off_regions
-
-# Plot Style
-style.use("tableau-colorblind10")
-
-# Suppress unnecessary warnings:
-
-from erfa import ErfaWarning
-
-warnings.filterwarnings("ignore", message=".*dubious year.*", category=ErfaWarning)
-warnings.filterwarnings("ignore", message=".*color.*property will override.*")